@@ -0,0 +1,141 @@
+"""
+Per-question item analysis for an assignment.
+
+All statistics come from one aggregation over the assignment's
+submissions ($unwind answers, then $group per question and per response).
+Python only post-processes one row per question. Reports are cached in the
+`item_analysis` collection and invalidated whenever a new submission
+arrives, so repeat views cost one indexed find_one.
+"""
+import math
+from datetime import datetime
+from pymongo.errors import DuplicateKeyError
+from database import get_db, tenant_db
+
+# Most common responses kept per question (covers every MC option).
+MAX_RESPONSES_PER_QUESTION = 25
+
+def _normalized_answer():
+    # Mirrors grading: single_response answers are compared trimmed and lower-cased.
+    return {"$toLower": {"$trim": {"input": {"$ifNull": [{"$toString": "$answers.student_answer"}, ""]}}}}
+
+def _pipeline(assignment_id):
+    unwind = {"$unwind": {"path": "$answers", "includeArrayIndex": "q"}}
+    return [
+        {"$match": {"assignment_id": assignment_id}},
+        {"$project": {"score": 1, "answers.student_answer": 1, "answers.is_correct": 1}},
+        {"$facet": {
+            "totals": [
+                {"$group": {"_id": None,
+                            "n": {"$sum": 1},
+                            "sum": {"$sum": "$score"},
+                            "sumsq": {"$sum": {"$multiply": ["$score", "$score"]}}}},
+            ],
+            "items": [
+                unwind,
+                {"$group": {"_id": "$q",
+                            "n": {"$sum": 1},
+                            "correct": {"$sum": {"$cond": ["$answers.is_correct", 1, 0]}},
+                            "sum_correct": {"$sum": {"$cond": ["$answers.is_correct", "$score", 0]}},
+                            "sum_all": {"$sum": "$score"}}},
+            ],
+            "responses": [
+                unwind,
+                {"$group": {"_id": {"q": "$q", "answer": _normalized_answer()},
+                            "count": {"$sum": 1},
+                            "correct": {"$max": "$answers.is_correct"}}},
+                {"$sort": {"count": -1}},
+                {"$group": {"_id": "$_id.q",
+                            "responses": {"$push": {"answer": "$_id.answer",
+                                                    "count": "$count",
+                                                    "correct": "$correct"}}}},
+                {"$project": {"responses": {"$slice": ["$responses", MAX_RESPONSES_PER_QUESTION]}}},
+            ],
+        }},
+    ]
+
+def point_biserial(n, correct, sum_correct, sum_all, mean, std):
+    """
+    Point-biserial correlation between getting the item right and the total
+    score, from aggregate sums. Returns None when it is undefined (everyone
+    right or wrong, or no score variance).
+    """
+    wrong = n - correct
+    if not correct or not wrong or not std:
+        return None
+    m1 = sum_correct / correct
+    m0 = (sum_all - sum_correct) / wrong
+    p = correct / n
+    return (m1 - m0) / std * math.sqrt(p * (1 - p))
+
+def compute_item_analysis(assignment):
+    """Runs the aggregation and builds the report for one assignment."""
+    db = tenant_db()
+    result = next(db.submissions.aggregate(_pipeline(assignment["_id"]), allowDiskUse=True))
+
+    totals = result["totals"][0] if result["totals"] else {"n": 0, "sum": 0, "sumsq": 0}
+    n = totals["n"]
+    mean = totals["sum"] / n if n else 0
+    std = math.sqrt(max(totals["sumsq"] / n - mean * mean, 0)) if n else 0
+
+    items = {row["_id"]: row for row in result["items"]}
+    responses = {row["_id"]: row["responses"] for row in result["responses"]}
+
+    questions = []
+    for i, question in enumerate(assignment.get("questions", [])):
+        item = items.get(i, {"n": 0, "correct": 0, "sum_correct": 0, "sum_all": 0})
+        entry = {
+            "index": i,
+            "text": question.get("text", ""),
+            "type": question.get("type"),
+            "responses": item["n"],
+            "p_value": item["correct"] / item["n"] if item["n"] else None,
+            "discrimination": point_biserial(item["n"], item["correct"], item["sum_correct"],
+                                             item["sum_all"], mean, std),
+        }
+        if question.get("type") == "multiple_choice":
+            counts = {r["answer"]: r["count"] for r in responses.get(i, [])}
+            entry["options"] = [
+                {"text": option, "count": counts.get(str(j), 0),
+                 "correct": j == question.get("answer")}
+                for j, option in enumerate(question.get("options", []))
+            ]
+        else:
+            entry["wrong_answers"] = [
+                {"answer": r["answer"], "count": r["count"]}
+                for r in responses.get(i, []) if not r["correct"] and r["answer"]
+            ][:10]
+        questions.append(entry)
+
+    return {"submissions": n, "mean_score": mean, "std_score": std, "questions": questions}
+
+def item_analysis(assignment):
+    """
+    Returns the cached report for an assignment, computing it if needed.
+    The cache version is bumped by invalidate_item_analysis(); a report
+    computed while a submission lands is not saved over the newer version.
+    """
+    db = get_db()
+    cached = db.item_analysis.find_one({"_id": assignment["_id"]}) or {}
+    if cached.get("report"):
+        return cached["report"]
+
+    version = cached.get("version", 0)
+    report = compute_item_analysis(assignment)
+    try:
+        db.item_analysis.update_one(
+            {"_id": assignment["_id"], "version": version},
+            {"$set": {"report": report, "computed_at": datetime.utcnow()}},
+            upsert=not cached,
+        )
+    except DuplicateKeyError:
+        pass  # invalidated while we were computing; the next view recomputes
+    return report
+
+def invalidate_item_analysis(assignment_id):
+    """Call whenever a submission for the assignment is added or changed."""
+    get_db().item_analysis.update_one(
+        {"_id": assignment_id},
+        {"$inc": {"version": 1}, "$unset": {"report": ""}},
+        upsert=True,
+    )
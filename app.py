@@ -1,41 +1,109 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, abort, send_from_directory
-from flask_pymongo import PyMongo
+from flask import Flask, render_template, request, redirect, url_for, flash, abort, send_from_directory, Response, current_app, jsonify
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager, login_user, logout_user, login_required, UserMixin, current_user
 from bson.objectid import ObjectId
 from dotenv import load_dotenv
 from werkzeug.utils import secure_filename
 from teacher import teacher_bp
-from database import init_app, mongo
-from pymongo import MongoClient, ASCENDING
-import math
+from database import init_app, mongo, tenant_db, DEFAULT_CENTER_ID
+from fields import parse_date, format_date, parse_fee, format_fee, parse_capacity
+from schedule import month_view, month_ics
+from cache_bus import cached, notify
+from migrations import register_commands as register_migration_commands
+from denorm import propagate
+from analytics import item_analysis, invalidate_item_analysis
+import question_gen
+import registration
+import datagen
+import middleware
+import profiling
+from profiling import span
+from pymongo import ReturnDocument
 from datetime import datetime
-import calendar
 import os
 
-load_dotenv() # Load environment variables from .env file
-
-app = Flask(__name__)
-# It's best practice to load sensitive data from environment variables.
-# The second argument to .get() is a default value, useful for local development.
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
-app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
-
-# Initialize the database
-init_app(app)
-
- # Register blueprints
-app.register_blueprint(teacher_bp)
-
-# --- Configuration Validation ---
-# Ensure essential variables are set, otherwise raise a clear error.
-if not app.config['SECRET_KEY']:
-    raise RuntimeError("SECRET_KEY not set. Please check your .env file.")
-
-bcrypt = Bcrypt(app)
-login_manager = LoginManager(app)
+# Extensions are created unbound and attached to the app in create_app().
+bcrypt = Bcrypt()
+login_manager = LoginManager()
 login_manager.login_view = 'login'
 
+# Views in this module register themselves here and are added to the app by
+# create_app(), keeping their endpoint names unprefixed (url_for('dashboard')).
+_routes = []
+
+def route(rule, **options):
+    def decorator(view_func):
+        _routes.append((rule, view_func, options))
+        return view_func
+    return decorator
+
+def create_app(config=None):
+    """
+    Application factory. Run under gunicorn as "app:create_app()".
+    `flask --app app` finds it automatically.
+    Indexes are not created here; run `flask create-indexes` once per
+    deploy, or let gunicorn.conf.py do it once in the master process.
+    """
+    load_dotenv() # Load environment variables from .env file
+
+    app = Flask(__name__)
+    # It's best practice to load sensitive data from environment variables.
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+    app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+    if config:
+        app.config.update(config)
+
+    # --- Configuration Validation ---
+    # Ensure essential variables are set, otherwise raise a clear error.
+    if not app.config['SECRET_KEY']:
+        raise RuntimeError("SECRET_KEY not set. Please check your .env file.")
+
+    # Request timing, ?_profile=1 and /metrics. Before init_app so the
+    # Mongo command listener is registered before the client is created.
+    profiling.init_app(app)
+
+    # Initialize the database (also adds `flask create-indexes`)
+    init_app(app)
+
+    # Register blueprints
+    app.register_blueprint(teacher_bp)
+
+    bcrypt.init_app(app)
+    login_manager.init_app(app)
+    # Compression, ETags/304s and fingerprinted static URLs
+    middleware.init_app(app)
+
+    # Class dates are datetimes and fees are numbers; format them in templates.
+    app.add_template_filter(format_date, 'date')
+    app.add_template_filter(format_fee, 'fee')
+
+    for rule, view_func, options in _routes:
+        app.add_url_rule(rule, view_func=view_func, **options)
+
+    # Data migrations: `flask migrate`, `flask migrate-status`
+    register_migration_commands(app)
+    # Synthetic data for local profiling: `flask generate-data`
+    datagen.register_commands(app)
+    # Seat counter repair: `flask recount-seats`
+    registration.register_commands(app)
+
+    return app
+
+def __getattr__(name):
+    # Backwards compatibility for "gunicorn app:app": build the app on first
+    # access instead of at import time.
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Upper bound on a single autosaved answer, to keep draft documents small.
+MAX_DRAFT_ANSWER_LENGTH = 2000
+# Roles a user can pick when signing up. Admins are made in the database,
+# never through the form (admins also get ?_profile=1 and teacher access).
+SELF_REGISTER_ROLES = ('student', 'teacher')
+
 # ---------------------------- User Loader ----------------------------
 class User(UserMixin):
     def __init__(self, user_data):
@@ -43,23 +111,45 @@ class User(UserMixin):
         self.name = user_data['name']
         self.email = user_data['email']
         self.role = user_data['role']
+        self.center_id = user_data.get('center_id', DEFAULT_CENTER_ID)
+
+@cached('users', per_center=False)
+def load_user_doc(user_id):
+    # Unscoped: the center comes from the user, so it isn't known yet.
+    return mongo.db.users.find_one({'_id': ObjectId(user_id)},
+                                   {'name': 1, 'email': 1, 'role': 1, 'center_id': 1})
 
 @login_manager.user_loader
 def load_user(user_id):
-    user = mongo.db.users.find_one({'_id': ObjectId(user_id)})
+    user = load_user_doc(user_id)
     return User(user) if user else None
 
+# ---------------------------- Cached Loaders ----------------------------
+# Invalidated across workers by cache_bus; call notify() after writing.
+@cached('classes')
+def load_active_classes():
+    # Sort by start_date in ascending order (1) to show the soonest classes first.
+    return list(tenant_db().classes.find({'is_active': True}).sort('start_date', 1))
+
+@cached('assignments')
+def load_assignment(assignment_id):
+    return tenant_db().assignments.find_one({'_id': ObjectId(assignment_id)})
+
+def load_assignment_or_404(assignment_id):
+    assignment = load_assignment(str(assignment_id))
+    if assignment is None:
+        abort(404)
+    return assignment
+
 # ---------------------------- Routes ----------------------------
 
-@app.route('/')
+@route('/')
 def index():
-    # Fetch all active classes
-    # Sort by start_date in ascending order (1) to show the soonest classes first.
-    active_classes = list(mongo.db.classes.find({'is_active': True}).sort('start_date', 1))
-    return render_template('index.html', classes=active_classes)
+    # Fetch all active classes, soonest first
+    return render_template('index.html', classes=load_active_classes())
 
 
-@app.route('/register', methods=['GET', 'POST'])
+@route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         # Use .get() to safely access form data and prevent crashes
@@ -73,23 +163,31 @@ def register():
             flash('All fields are required.', 'error')
             return redirect(url_for('register'))
 
+        if role not in SELF_REGISTER_ROLES:
+            flash('Please choose Student or Teacher.', 'error')
+            return redirect(url_for('register'))
+
         # Check if user already exists to prevent duplicates
+        # E-mails are unique across centers: login looks users up by e-mail alone.
         if mongo.db.users.find_one({'email': email}):
             # In a real app, you'd flash a message to the user here
             flash('User already exists.', 'error')
             return redirect(url_for('register'))
 
-        mongo.db.users.insert_one({
+        with span('bcrypt'):
+            password_hash = bcrypt.generate_password_hash(password_from_form).decode('utf-8')
+        tenant_db().users.insert_one({
             'name': name,
             'email': email,
-            'password_hash': bcrypt.generate_password_hash(password_from_form).decode('utf-8'),
+            'password_hash': password_hash,
             'role': role,
             'enrolled_classes': []
         })
+        notify('users')
         return redirect(url_for('login'))
     return render_template('register.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         # Use .get() to safely access form data
@@ -102,7 +200,9 @@ def login():
             return redirect(url_for('login'))
 
         user_data = mongo.db.users.find_one({'email': email})
-        if user_data and bcrypt.check_password_hash(user_data['password_hash'], password):
+        with span('bcrypt'):
+            valid = bool(user_data) and bcrypt.check_password_hash(user_data['password_hash'], password)
+        if valid:
             login_user(User(user_data))
             return redirect(url_for('dashboard'))
         
@@ -110,7 +210,7 @@ def login():
         flash('Invalid email or password. Please try again.', 'error')
     return render_template('login.html')
 
-@app.route('/dashboard')
+@route('/dashboard')
 @login_required
 def dashboard():
     # Initialize variables for both roles
@@ -123,11 +223,11 @@ def dashboard():
 
     if current_user.role == 'teacher':
         # Fetch all classes created by the teacher, sorted by name
-        classes = list(mongo.db.classes.find({'created_by': ObjectId(current_user.id)}).sort('name', 1))
+        classes = list(tenant_db().classes.find({'created_by': ObjectId(current_user.id)}).sort('name', 1))
 
         # For each class, find its assigned assignments
         for a_class in classes:
-            a_class['assignments'] = list(mongo.db.assignments.find({
+            a_class['assignments'] = list(tenant_db().assignments.find({
                 'created_by': ObjectId(current_user.id),
                 'assigned_to_classes': a_class['_id']
             }).sort('created_at', -1))
@@ -135,9 +235,9 @@ def dashboard():
         classes_with_assignments = classes
 
         # Find all assignments that are not assigned to any class
-        unassigned_assignments = list(mongo.db.assignments.find({
+        unassigned_assignments = list(tenant_db().assignments.find({
             'created_by': ObjectId(current_user.id),
-            'assigned_to_classes': {'$exists': False, '$eq': []}
+            'assigned_to_classes': []  # backfilled for older assignments by migration 0003
         }).sort('created_at', -1))
         
         # New: Fetch assignment templates created by the teacher
@@ -148,18 +248,23 @@ def dashboard():
 
     elif current_user.role == 'student':
         # Fetch student's registered class IDs
-        registrations = list(mongo.db.class_registrations.find({'student_id': ObjectId(current_user.id)}))
-        registered_class_ids = [reg['class_id'] for reg in registrations if 'class_id' in reg]
-        
-        # Fetch the full class objects
-        student_classes = list(mongo.db.classes.find({'_id': {'$in': registered_class_ids}}))
+        registrations = list(tenant_db().class_registrations.find(
+            {'student_id': ObjectId(current_user.id), 'status': {'$ne': registration.DROPPED}}))
+        waitlisted_ids = {reg['class_id'] for reg in registrations if reg.get('status') == registration.WAITLISTED}
+        registered_class_ids = [reg['class_id'] for reg in registrations
+                                if 'class_id' in reg and reg['class_id'] not in waitlisted_ids]
+
+        # Fetch the full class objects (waitlisted ones too, marked in the template)
+        student_classes = list(tenant_db().classes.find({'_id': {'$in': registered_class_ids + list(waitlisted_ids)}}))
+        for a_class in student_classes:
+            a_class['waitlisted'] = a_class['_id'] in waitlisted_ids
 
         # Find assignments for those classes
         if registered_class_ids:
-            student_assignments = list(mongo.db.assignments.find({'assigned_to_classes': {'$in': registered_class_ids}}))
+            student_assignments = list(tenant_db().assignments.find({'assigned_to_classes': {'$in': registered_class_ids}}))
         
         # Map submissions for easy lookup
-        submissions = list(mongo.db.submissions.find({'student_id': ObjectId(current_user.id)}))
+        submissions = list(tenant_db().submissions.find({'student_id': ObjectId(current_user.id)}))
         submissions_map = {str(sub['assignment_id']): str(sub['_id']) for sub in submissions}
 
     return render_template('dashboard.html', 
@@ -170,14 +275,14 @@ def dashboard():
                            submissions_map=submissions_map,
                            teacher_templates=teacher_templates)
 
-@app.route('/logout')
+@route('/logout')
 @login_required
 def logout():
     logout_user()
     return redirect(url_for('index'))
 
 # ---------------------------- Assignment Creation ----------------------------
-@app.route('/create_assignment', methods=['GET', 'POST'])
+@route('/create_assignment', methods=['GET', 'POST'])
 @login_required
 def create_assignment():
     # Authorization check: Only teachers can create assignments.
@@ -215,18 +320,20 @@ def create_assignment():
             
             questions.append(question_data)
 
-        mongo.db.assignments.insert_one({
+        tenant_db().assignments.insert_one({
             'title': title,
             'questions': questions,
             'created_by': ObjectId(current_user.id), # Track who created the test
-            'created_at': datetime.utcnow()
+            'created_at': datetime.utcnow(),
+            'assigned_to_classes': []  # Explicitly initialize as unassigned
         })
+        notify('assignments')
         flash('Assignment created successfully!', 'success')
         return redirect(url_for('dashboard'))
     return render_template('create_assignment.html')
 
 # ---------------------------- Assignment Template Creation ----------------------------
-@app.route('/create_assignment_template', methods=['GET', 'POST'])
+@route('/create_assignment_template', methods=['GET', 'POST'])
 @login_required
 def create_assignment_template():
     # Authorization check: Only teachers can create templates.
@@ -273,8 +380,47 @@ def create_assignment_template():
         
     return render_template('create_assignment_template.html')
 
+# ---------------------------- Question Generation (Teacher) ----------------------------
+@route('/create_assignment_template/generate', methods=['POST'])
+@login_required
+def generate_questions():
+    """
+    Starts a background generation job and returns its id immediately;
+    the page polls generate_questions_status for the result.
+    """
+    if current_user.role != 'teacher':
+        abort(403)
+
+    payload = request.get_json(silent=True) or {}
+    topic = (payload.get('topic') or '').strip()
+    q_type = payload.get('type') or 'single_response'
+    try:
+        count = int(payload.get('count') or 5)
+    except (TypeError, ValueError):
+        count = 0
+    if not topic or q_type not in question_gen.QUESTION_TYPES or not 1 <= count <= question_gen.MAX_QUESTIONS_PER_JOB:
+        return jsonify({'error': f'Provide a topic, a question type and 1-{question_gen.MAX_QUESTIONS_PER_JOB} questions.'}), 400
+
+    job_id = question_gen.start_job(current_user.id, topic[:500], count, q_type)
+    return jsonify({'job_id': str(job_id),
+                    'status_url': url_for('generate_questions_status', job_id=job_id)}), 202
+
+@route('/create_assignment_template/generate/<job_id>')
+@login_required
+def generate_questions_status(job_id):
+    if current_user.role != 'teacher':
+        abort(403)
+
+    job = mongo.db.question_gen_jobs.find_one_or_404({'_id': ObjectId(job_id)})
+    if job['created_by'] != ObjectId(current_user.id):
+        abort(403)
+    job = question_gen.expire_job(job)
+    return jsonify({'status': job['status'],
+                    'questions': job.get('questions', []),
+                    'error': job.get('error')})
+
 # ---------------------------- Create Assignment From Template ----------------------------
-@app.route('/create_assignment_from_template/<template_id>', methods=['GET', 'POST'])
+@route('/create_assignment_from_template/<template_id>', methods=['GET', 'POST'])
 @login_required
 def create_assignment_from_template(template_id):
     if current_user.role != 'teacher':
@@ -315,26 +461,27 @@ def create_assignment_from_template(template_id):
             
             questions.append(question_data)
 
-        mongo.db.assignments.insert_one({
+        tenant_db().assignments.insert_one({
             'title': title,
             'questions': questions,
             'created_by': ObjectId(current_user.id),
             'created_at': datetime.utcnow(),
             'assigned_to_classes': []  # Explicitly initialize as unassigned
         })
+        notify('assignments')
         flash('Assignment created successfully from template!', 'success')
         return redirect(url_for('dashboard'))
 
     return render_template('create_assignment_from_template.html', template=template)
 
 # ---------------------------- Assignment Edit (Teacher) ----------------------------
-@app.route('/edit_assignment/<assignment_id>', methods=['GET', 'POST'])
+@route('/edit_assignment/<assignment_id>', methods=['GET', 'POST'])
 @login_required
 def edit_assignment(assignment_id):
     if current_user.role != 'teacher':
         abort(403)
 
-    assignment = mongo.db.assignments.find_one_or_404({'_id': ObjectId(assignment_id)})
+    assignment = tenant_db().assignments.find_one_or_404({'_id': ObjectId(assignment_id)})
     # Security check: ensure the teacher owns this assignment
     if assignment['created_by'] != ObjectId(current_user.id):
         abort(403)
@@ -368,27 +515,50 @@ def edit_assignment(assignment_id):
             
             questions.append(question_data)
 
-        mongo.db.assignments.update_one(
+        tenant_db().assignments.update_one(
             {'_id': ObjectId(assignment_id)},
             {'$set': {
                 'title': title,
                 'questions': questions
             }}
         )
+        notify('assignments')
+        invalidate_item_analysis(ObjectId(assignment_id))
         flash('Assignment updated successfully!', 'success')
         return redirect(url_for('dashboard'))
 
     # For GET request, pass the assignment data to the template
     return render_template('edit_assignment.html', assignment=assignment)
 
+# ---------------------------- Delete Assignment (Teacher) ----------------------------
+@route('/delete_assignment/<assignment_id>', methods=['POST'])
+@login_required
+def delete_assignment(assignment_id):
+    if current_user.role != 'teacher':
+        abort(403)
+
+    assignment = tenant_db().assignments.find_one_or_404({'_id': ObjectId(assignment_id)})
+    # Security check: ensure the teacher owns this assignment
+    if assignment['created_by'] != ObjectId(current_user.id):
+        abort(403)
+    # Only unassigned assignments can be deleted (the dashboard only offers it for those)
+    if assignment.get('assigned_to_classes'):
+        flash('Unassign this assignment from all classes before deleting it.', 'error')
+        return redirect(url_for('dashboard'))
+
+    tenant_db().assignments.delete_one({'_id': ObjectId(assignment_id)})
+    notify('assignments')
+    flash(f'Assignment "{assignment["title"]}" deleted.', 'success')
+    return redirect(url_for('dashboard'))
+
 # ---------------------------- Assign Assignment (Teacher) ----------------------------
-@app.route('/assign_assignment/<assignment_id>', methods=['GET', 'POST'])
+@route('/assign_assignment/<assignment_id>', methods=['GET', 'POST'])
 @login_required
 def assign_assignment(assignment_id):
     if current_user.role != 'teacher':
         abort(403)
 
-    assignment = mongo.db.assignments.find_one_or_404({'_id': ObjectId(assignment_id)})
+    assignment = tenant_db().assignments.find_one_or_404({'_id': ObjectId(assignment_id)})
     # Security check: ensure the teacher owns this assignment
     if assignment['created_by'] != ObjectId(current_user.id):
         abort(403)
@@ -397,16 +567,17 @@ def assign_assignment(assignment_id):
         class_ids = request.form.getlist('class_ids')
         class_object_ids = [ObjectId(cid) for cid in class_ids]
 
-        mongo.db.assignments.update_one(
+        tenant_db().assignments.update_one(
             {'_id': ObjectId(assignment_id)},
             {'$set': {'assigned_to_classes': class_object_ids}}
         )
+        notify('assignments')
 
         flash(f'Assignment "{assignment["title"]}" has been assigned.', 'success')
         return redirect(url_for('dashboard'))
 
     # GET request
-    teacher_classes = list(mongo.db.classes.find({
+    teacher_classes = list(tenant_db().classes.find({
         'created_by': ObjectId(current_user.id),
         'is_active': True
     }))
@@ -414,7 +585,7 @@ def assign_assignment(assignment_id):
 
 
 # ---------------------------- Class Creation (Teacher) ----------------------------
-@app.route('/create_class', methods=['GET', 'POST'])
+@route('/create_class', methods=['GET', 'POST'])
 @login_required
 def create_class():
     # Authorization: Only teachers can create classes.
@@ -426,6 +597,7 @@ def create_class():
         start_date = request.form.get('start_date')
         end_date = request.form.get('end_date')
         fee = request.form.get('fee')
+        capacity = request.form.get('capacity')
         # Checkbox value will be 'on' if checked, None otherwise.
         is_active = 'is_active' in request.form
 
@@ -433,15 +605,35 @@ def create_class():
             flash('Please fill out all fields.', 'error')
             return redirect(url_for('create_class'))
 
-        mongo.db.classes.insert_one({
+        # Store real datetimes so the schedule can run range queries
+        try:
+            start_date, end_date = parse_date(start_date), parse_date(end_date)
+        except ValueError:
+            flash('Please enter valid start and end dates.', 'error')
+            return redirect(url_for('create_class'))
+        try:
+            fee = parse_fee(fee)
+        except ValueError:
+            flash('Please enter a valid fee.', 'error')
+            return redirect(url_for('create_class'))
+        try:
+            capacity = parse_capacity(capacity)
+        except ValueError:
+            flash('Please enter a valid capacity, or leave it empty for no limit.', 'error')
+            return redirect(url_for('create_class'))
+
+        tenant_db().classes.insert_one({
             'name': class_name,
             'start_date': start_date,
             'end_date': end_date,
             'fee': fee,
+            'capacity': capacity,
+            'seats_taken': 0,
             'is_active': is_active,
             'created_by': ObjectId(current_user.id),
             'created_at': datetime.utcnow()
         })
+        notify('classes')
 
         flash(f'Class "{class_name}" created successfully!', 'success')
         return redirect(url_for('dashboard'))
@@ -449,13 +641,13 @@ def create_class():
     return render_template('create_class.html')
 
 # ---------------------------- Class Edit (Teacher) ----------------------------
-@app.route('/edit_class/<class_id>', methods=['GET', 'POST'])
+@route('/edit_class/<class_id>', methods=['GET', 'POST'])
 @login_required
 def edit_class(class_id):
     if current_user.role != 'teacher':
         abort(403)
 
-    class_obj = mongo.db.classes.find_one_or_404({'_id': ObjectId(class_id)})
+    class_obj = tenant_db().classes.find_one_or_404({'_id': ObjectId(class_id)})
     # Security check: ensure the teacher owns this class
     if class_obj['created_by'] != ObjectId(current_user.id):
         abort(403)
@@ -465,36 +657,94 @@ def edit_class(class_id):
         start_date = request.form.get('start_date')
         end_date = request.form.get('end_date')
         fee = request.form.get('fee')
+        capacity = request.form.get('capacity')
         is_active = 'is_active' in request.form
 
         if not all([class_name, start_date, end_date, fee]):
             flash('Please fill out all fields.', 'error')
             return redirect(url_for('edit_class', class_id=class_id))
 
-        mongo.db.classes.update_one(
+        try:
+            start_date, end_date = parse_date(start_date), parse_date(end_date)
+        except ValueError:
+            flash('Please enter valid start and end dates.', 'error')
+            return redirect(url_for('edit_class', class_id=class_id))
+        try:
+            fee = parse_fee(fee)
+        except ValueError:
+            flash('Please enter a valid fee.', 'error')
+            return redirect(url_for('edit_class', class_id=class_id))
+        try:
+            capacity = parse_capacity(capacity)
+        except ValueError:
+            flash('Please enter a valid capacity, or leave it empty for no limit.', 'error')
+            return redirect(url_for('edit_class', class_id=class_id))
+
+        tenant_db().classes.update_one(
             {'_id': ObjectId(class_id)},
             {'$set': {
                 'name': class_name,
                 'start_date': start_date,
                 'end_date': end_date,
                 'fee': fee,
+                'capacity': capacity,
                 'is_active': is_active
             }}
         )
+        notify('classes')
+        # A lowered capacity keeps everyone registered; a raised one fills from the waitlist.
+        if capacity != class_obj.get('capacity'):
+            registration.promote_waitlist(class_obj['_id'])
+        # Keep denormalized copies (e.g. class_registrations.class_name) in sync
+        if class_name != class_obj.get('name'):
+            propagate('classes', class_obj['_id'], {'name': class_name})
 
         flash(f'Class "{class_name}" updated successfully!', 'success')
         return redirect(url_for('dashboard'))
 
     return render_template('edit_class.html', class_obj=class_obj)
 
+# ---------------------------- Class Schedule ----------------------------
+def _schedule_params():
+    """Reads ?year=&month= (defaulting to the current month) and the teacher scope."""
+    today = datetime.utcnow()
+    year = request.args.get('year', today.year, type=int)
+    month = request.args.get('month', today.month, type=int)
+    # Years 2-9998 keep month_bounds() and the prev/next month links within datetime's range.
+    if not 1 <= month <= 12 or not 2 <= year <= 9998:
+        abort(400)
+    # Teachers see their own classes; everyone else sees active classes.
+    teacher_id = None
+    if current_user.is_authenticated and current_user.role == 'teacher':
+        teacher_id = current_user.id
+    return year, month, teacher_id
+
+@route('/schedule')
+def schedule():
+    year, month, teacher_id = _schedule_params()
+    prev_year, prev_month = (year - 1, 12) if month == 1 else (year, month - 1)
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return render_template('schedule.html',
+                           prev_year=prev_year, prev_month=prev_month,
+                           next_year=next_year, next_month=next_month,
+                           month=month,
+                           **month_view(year, month, teacher_id))
+
+@route('/schedule.ics')
+def schedule_ics():
+    year, month, teacher_id = _schedule_params()
+    return Response(month_ics(year, month, teacher_id, host=request.host),
+                    mimetype='text/calendar',
+                    headers={'Content-Disposition': f'attachment; filename=schedule-{year}-{month:02d}.ics'})
+
 # ---------------------------- PDF Upload (Teacher) ----------------------------
-@app.route('/upload_pdf/<class_id>', methods=['GET', 'POST'])
+@route('/upload_pdf/<class_id>', methods=['GET', 'POST'])
 @login_required
 def upload_pdf(class_id):
     if current_user.role != 'teacher':
         abort(403)
 
-    class_obj = mongo.db.classes.find_one_or_404({'_id': ObjectId(class_id)})
+    class_obj = tenant_db().classes.find_one_or_404({'_id': ObjectId(class_id)})
     if class_obj['created_by'] != ObjectId(current_user.id):
         abort(403)
 
@@ -508,23 +758,24 @@ def upload_pdf(class_id):
             return redirect(request.url)
         if file and file.filename.endswith('.pdf'):
             filename = secure_filename(file.filename)
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            file.save(os.path.join(current_app.config['UPLOAD_FOLDER'], filename))
             
             # Add file info to the class document
-            mongo.db.classes.update_one(
+            tenant_db().classes.update_one(
                 {'_id': ObjectId(class_id)},
                 {'$push': {'uploaded_files': {'filename': filename}}}
             )
+            notify('classes')
             flash('File uploaded successfully!', 'success')
             return redirect(url_for('dashboard'))
 
     return render_template('upload_pdf.html', class_obj=class_obj)
 
-@app.route('/uploads/<filename>')
+@route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
 # ---------------------------- Class Registration ----------------------------
-@app.route('/register_class', methods=['GET', 'POST'])
+@route('/register_class', methods=['GET', 'POST'])
 @login_required
 def register_class():
     # Authorization: Only students can register for a class.
@@ -543,42 +794,88 @@ def register_class():
             return redirect(url_for('register_class'))
 
         # Find the class to get its name for storage
-        class_obj = mongo.db.classes.find_one_or_404({'_id': ObjectId(class_id)})
+        class_obj = tenant_db().classes.find_one_or_404({'_id': ObjectId(class_id)})
 
-        # Prevent duplicate registration
-        existing_reg = mongo.db.class_registrations.find_one({'student_id': ObjectId(current_user.id), 'class_id': ObjectId(class_id)})
-        if existing_reg:
-            flash(f'You are already registered for {class_obj["name"]}.', 'warning')
-            return redirect(url_for('dashboard'))
-
-        mongo.db.class_registrations.insert_one({
-            'student_id': ObjectId(current_user.id),
-            'class_id': ObjectId(class_id),
+        # Claims a seat atomically, or joins the waitlist when the class is full
+        status = registration.register(class_obj, ObjectId(current_user.id), {
             'student_name': student_name,
             'contact_email': contact_email,
             'contact_phone': contact_phone,
-            'class_name': class_obj['name'], # Store name for easy display
-            'registration_date': datetime.utcnow()
         })
-
-        flash(f'You have successfully registered for {class_obj["name"]}!', 'success')
+        if status is None:
+            flash(f'You are already registered for {class_obj["name"]}.', 'warning')
+        elif status == registration.WAITLISTED:
+            flash(f'{class_obj["name"]} is full. You have been added to the waitlist.', 'warning')
+        else:
+            flash(f'You have successfully registered for {class_obj["name"]}!', 'success')
         return redirect(url_for('dashboard'))
 
     # GET request: Fetch only active classes to display in the form.
-    active_classes = list(mongo.db.classes.find({'is_active': True}))
-    return render_template('register_class.html', active_classes=active_classes)
+    return render_template('register_class.html', active_classes=load_active_classes(),
+                           seats_left=registration.seats_left)
+
+@route('/drop_class/<class_id>', methods=['POST'])
+@login_required
+def drop_class(class_id):
+    if current_user.role != 'student':
+        abort(403)
+    class_obj = tenant_db().classes.find_one_or_404({'_id': ObjectId(class_id)})
+    previous = registration.drop(class_obj['_id'], ObjectId(current_user.id))
+    if previous == registration.WAITLISTED:
+        flash(f'You have left the waitlist for {class_obj["name"]}.', 'success')
+    elif previous:
+        flash(f'You have dropped {class_obj["name"]}.', 'success')
+    else:
+        flash(f'You are not registered for {class_obj["name"]}.', 'warning')
+    return redirect(url_for('dashboard'))
 
 # ---------------------------- Take Assignment (Student) ----------------------------
-@app.route('/take_assignment/<assignment_id>', methods=['GET', 'POST'])
+def grade_answers(questions, answer_for):
+    """
+    Grades a list of questions. `answer_for(i)` returns the raw student answer
+    for question i (or None). Returns (answers, score).
+    """
+    answers = []
+    score = 0
+    for i, question in enumerate(questions):
+        student_answer_raw = answer_for(i)
+        is_correct = False
+        correct_answer = question.get('answer')
+
+        if question['type'] == 'single_response':
+            # Simple case-insensitive, whitespace-trimmed comparison
+            if student_answer_raw and isinstance(correct_answer, str):
+                is_correct = student_answer_raw.strip().lower() == correct_answer.strip().lower()
+
+        elif question['type'] == 'multiple_choice':
+            # Compare the submitted index with the correct index
+            if student_answer_raw is not None:
+                try:
+                    is_correct = int(student_answer_raw) == correct_answer
+                except (ValueError, TypeError):
+                    is_correct = False # Handle cases where conversion fails
+
+        if is_correct:
+            score += 1
+
+        answers.append({
+            'question_text': question['text'],
+            'student_answer': student_answer_raw,
+            'is_correct': is_correct
+        })
+    return answers, score
+
+@route('/take_assignment/<assignment_id>', methods=['GET', 'POST'])
 @login_required
 def take_assignment(assignment_id):
     if current_user.role != 'student':
         abort(403)
 
-    assignment = mongo.db.assignments.find_one_or_404({'_id': ObjectId(assignment_id)})
+    assignment = load_assignment_or_404(assignment_id)
 
     # Authorization: Check if student is in a class this is assigned to
-    registrations = list(mongo.db.class_registrations.find({'student_id': ObjectId(current_user.id)}))
+    registrations = list(tenant_db().class_registrations.find(
+        {'student_id': ObjectId(current_user.id), **registration.ACTIVE_FILTER}))
     # Safely get class_id, only for documents that have it.
     registered_class_ids = {reg['class_id'] for reg in registrations if 'class_id' in reg}
     assigned_class_ids = set(assignment.get('assigned_to_classes', []))
@@ -588,42 +885,23 @@ def take_assignment(assignment_id):
         return redirect(url_for('dashboard'))
 
     # Prevent re-submission
-    existing_submission = mongo.db.submissions.find_one({'student_id': ObjectId(current_user.id), 'assignment_id': ObjectId(assignment_id)})
+    existing_submission = tenant_db().submissions.find_one({'student_id': ObjectId(current_user.id), 'assignment_id': ObjectId(assignment_id)})
     if existing_submission:
         flash('You have already completed this assignment.', 'warning')
         return redirect(url_for('dashboard'))
 
+    draft_key = {'student_id': ObjectId(current_user.id), 'assignment_id': ObjectId(assignment_id)}
+
     if request.method == 'POST':
-        answers = []
-        score = 0
-        total_questions = len(assignment['questions'])
-
-        for i, question in enumerate(assignment['questions']):
-            student_answer_raw = request.form.get(f'answer_{i}')
-            is_correct = False
-            correct_answer = question.get('answer')
-
-            if question['type'] == 'single_response':
-                # Simple case-insensitive, whitespace-trimmed comparison
-                if student_answer_raw and isinstance(correct_answer, str):
-                    is_correct = student_answer_raw.strip().lower() == correct_answer.strip().lower()
-            
-            elif question['type'] == 'multiple_choice':
-                # Compare the submitted index with the correct index
-                if student_answer_raw is not None:
-                    try:
-                        is_correct = int(student_answer_raw) == correct_answer
-                    except (ValueError, TypeError):
-                        is_correct = False # Handle cases where conversion fails
-            
-            if is_correct:
-                score += 1
+        # Finalize from the autosaved draft; anything posted with the form wins.
+        draft = mongo.db.submission_drafts.find_one(draft_key) or {}
+        draft_answers = draft.get('answers', {})
+
+        def answer_for(i):
+            posted = request.form.get(f'answer_{i}')
+            return posted if posted is not None else draft_answers.get(str(i))
 
-            answers.append({
-                'question_text': question['text'], 
-                'student_answer': student_answer_raw,
-                'is_correct': is_correct
-            })
+        answers, score = grade_answers(assignment['questions'], answer_for)
 
         submission_doc = {
             'assignment_id': ObjectId(assignment_id),
@@ -631,21 +909,64 @@ def take_assignment(assignment_id):
             'submitted_at': datetime.utcnow(),
             'answers': answers,
             'score': score,
-            'total_questions': total_questions
+            'total_questions': len(assignment['questions'])
         }
-        result = mongo.db.submissions.insert_one(submission_doc)
+        result = tenant_db().submissions.insert_one(submission_doc)
+        mongo.db.submission_drafts.delete_one(draft_key)
+        invalidate_item_analysis(ObjectId(assignment_id))
 
         flash('Your assignment has been submitted successfully!', 'success')
         return redirect(url_for('submission_summary', submission_id=result.inserted_id))
 
-    return render_template('take_assignment.html', assignment=assignment)
+    # GET: open (or resume) the draft. The authorization check above runs once
+    # here, so the autosave endpoint only has to match on this document.
+    draft = mongo.db.submission_drafts.find_one_and_update(
+        draft_key,
+        {'$setOnInsert': {'answers': {}, 'started_at': datetime.utcnow()},
+         '$set': {'num_questions': len(assignment['questions'])}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return render_template('take_assignment.html', assignment=assignment, draft_answers=draft.get('answers', {}))
+
+@route('/take_assignment/<assignment_id>/draft', methods=['POST'])
+@login_required
+def save_draft_answer(assignment_id):
+    """
+    Autosave a single answer: {"question": <index>, "answer": <value>}.
+    This is one indexed $set on the student's own draft, with no other reads,
+    so frequent autosaves from many students stay cheap.
+    """
+    if current_user.role != 'student':
+        abort(403)
 
-@app.route('/submission_summary/<submission_id>')
+    payload = request.get_json(silent=True) or {}
+    try:
+        index = int(payload.get('question'))
+    except (TypeError, ValueError):
+        abort(400)
+    answer = payload.get('answer')
+    if index < 0 or (answer is not None and not isinstance(answer, str)) or len(answer or '') > MAX_DRAFT_ANSWER_LENGTH:
+        abort(400)
+
+    # The draft only exists once take_assignment has authorized the student,
+    # and num_questions bounds the index so drafts can't grow without limit.
+    result = mongo.db.submission_drafts.update_one(
+        {'student_id': ObjectId(current_user.id),
+         'assignment_id': ObjectId(assignment_id),
+         'num_questions': {'$gt': index}},
+        {'$set': {f'answers.{index}': answer, 'updated_at': datetime.utcnow()}}
+    )
+    if result.matched_count == 0:
+        abort(404)
+    return ('', 204)
+
+@route('/submission_summary/<submission_id>')
 @login_required
 def submission_summary(submission_id):
-    submission = mongo.db.submissions.find_one_or_404({'_id': ObjectId(submission_id)})
+    submission = tenant_db().submissions.find_one_or_404({'_id': ObjectId(submission_id)})
     # Fetch the original assignment to get all question data and correct answers
-    assignment = mongo.db.assignments.find_one_or_404({'_id': submission['assignment_id']})
+    assignment = load_assignment_or_404(submission['assignment_id'])
 
     # --- Enhanced Security Check ---
     # Allow access if the user is the student who made the submission
@@ -660,29 +981,42 @@ def submission_summary(submission_id):
 
     return render_template('submission_summary.html', submission=submission, assignment=assignment)
 
-@app.route('/assignment_tracking')
+@route('/assignment_analysis/<assignment_id>')
+@login_required
+def assignment_analysis(assignment_id):
+    if current_user.role != 'teacher':
+        abort(403)
+
+    assignment = tenant_db().assignments.find_one_or_404({'_id': ObjectId(assignment_id)})
+    # Security check: ensure the teacher owns this assignment
+    if assignment['created_by'] != ObjectId(current_user.id):
+        abort(403)
+
+    return render_template('item_analysis.html', assignment=assignment, report=item_analysis(assignment))
+
+@route('/assignment_tracking')
 @login_required
 def assignment_tracking():
     if current_user.role != 'teacher':
         abort(403)
 
-    teacher_classes = list(mongo.db.classes.find({'created_by': ObjectId(current_user.id)}))
+    teacher_classes = list(tenant_db().classes.find({'created_by': ObjectId(current_user.id)}))
     
     tracking_data = []
     for a_class in teacher_classes:
         class_id = a_class['_id']
         
         # Get all assignments for this class
-        assignments_in_class = list(mongo.db.assignments.find({'assigned_to_classes': class_id}))
+        assignments_in_class = list(tenant_db().assignments.find({'assigned_to_classes': class_id}))
         
         # Get all students registered in this class
-        registrations = list(mongo.db.class_registrations.find({'class_id': class_id}))
+        registrations = list(tenant_db().class_registrations.find({'class_id': class_id, **registration.ACTIVE_FILTER}))
         student_ids = [reg['student_id'] for reg in registrations]
-        students = {str(s['_id']): s['name'] for s in mongo.db.users.find({'_id': {'$in': student_ids}})}
+        students = {str(s['_id']): s['name'] for s in tenant_db().users.find({'_id': {'$in': student_ids}})}
         
         # Get all submissions for these students and assignments
         assignment_ids = [a['_id'] for a in assignments_in_class]
-        submissions = list(mongo.db.submissions.find({'student_id': {'$in': student_ids}, 'assignment_id': {'$in': assignment_ids}}))
+        submissions = list(tenant_db().submissions.find({'student_id': {'$in': student_ids}, 'assignment_id': {'$in': assignment_ids}}))
         
         # Structure submissions for easy lookup in the template
         submissions_map = {(str(s['student_id']), str(s['assignment_id'])): s for s in submissions}
@@ -691,4 +1025,4 @@ def assignment_tracking():
 
     return render_template('assignment_tracking.html', tracking_data=tracking_data)
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
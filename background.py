@@ -0,0 +1,42 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, g
+from database import current_center_id
+
+log = logging.getLogger(__name__)
+
+# Small shared pool for work that shouldn't hold up a request (fan-out
+# updates, long-running jobs). Created lazily so each gunicorn worker gets
+# its own pool after forking.
+BACKGROUND_WORKERS = int(os.environ.get("BACKGROUND_WORKERS", "2"))
+
+_executor = None
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS,
+                                       thread_name_prefix="background")
+    return _executor
+
+def submit(fn, *args, **kwargs):
+    """
+    Runs fn(*args, **kwargs) on the background pool inside an app context,
+    so it can use the database the same way a view does, scoped to the
+    caller's center. Must be called from within an app/request context.
+    Errors are logged, not raised.
+    """
+    app = current_app._get_current_object()
+    center_id = current_center_id()
+
+    def run():
+        with app.app_context():
+            g.center_id = center_id
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                log.exception("Background task %s failed", getattr(fn, "__name__", fn))
+                raise
+
+    return get_executor().submit(run)
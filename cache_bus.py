@@ -0,0 +1,151 @@
+"""
+In-process caching that stays correct across gunicorn workers and containers.
+
+Each watched collection has a generation counter in this process. A
+`@cached("classes")` loader stores results along with the generations it
+read under, and any bump makes those entries misses. Generations are
+bumped by:
+
+- this process's own writes, via notify(collection), so a worker always
+  reads its own writes;
+- a MongoDB change stream on the watched collections (replica sets and
+  sharded clusters), which also catches writes from other workers,
+  containers and the mongo shell;
+- or, when change streams aren't available (standalone mongod), a poller
+  that reads the per-collection version counters notify() keeps in the
+  `cache_versions` collection.
+
+CACHE_BUS selects the mode: "auto" (default: change streams, falling back
+to polling), "polling", or "off" (no caching at all). Every entry also has
+a TTL as a backstop.
+
+Entries are keyed by the current center as well as the arguments, so one
+center never sees another's cached rows.
+"""
+import logging
+import os
+import threading
+import time
+from functools import wraps
+from pymongo.errors import OperationFailure, PyMongoError
+from database import current_center_id, get_db
+
+log = logging.getLogger(__name__)
+
+WATCHED_COLLECTIONS = ("users", "classes", "assignments", "students")
+CACHE_BUS = os.environ.get("CACHE_BUS", "auto")
+POLL_INTERVAL = float(os.environ.get("CACHE_POLL_INTERVAL", "2"))
+DEFAULT_TTL = 300
+RETRY_DELAY = 5
+
+_generations = {c: 0 for c in WATCHED_COLLECTIONS}
+_watcher_lock = threading.Lock()
+_watcher_pid = None
+
+def _bump(*collections):
+    for c in collections:
+        _generations[c] += 1
+
+def notify(*collections):
+    """
+    Call after writing to any watched collection. Invalidates this
+    worker's entries immediately and bumps the shared version counter
+    that polling workers watch.
+    """
+    if CACHE_BUS == "off":
+        return
+    _bump(*collections)
+    db = get_db()
+    for c in collections:
+        db.cache_versions.update_one({"_id": c}, {"$inc": {"version": 1}}, upsert=True)
+
+def cached(*collections, ttl=DEFAULT_TTL, maxsize=1024, per_center=True):
+    """
+    Memoizes a loader by its positional arguments (and the current center)
+    until any of `collections` changes. Loaders must return data that
+    callers don't mutate. per_center=False is for loaders keyed by globally
+    unique ids that run before the center is known (e.g. the user loader).
+    """
+    unknown = set(collections) - set(WATCHED_COLLECTIONS)
+    if unknown:
+        raise ValueError(f"Collections not watched by the cache bus: {sorted(unknown)}")
+
+    def decorator(fn):
+        store = {}
+
+        @wraps(fn)
+        def wrapper(*args):
+            if CACHE_BUS == "off":
+                return fn(*args)
+            _ensure_watcher()
+            # Read generations before loading, so a write racing with the
+            # load leaves the entry already stale.
+            generation = tuple(_generations[c] for c in collections)
+            now = time.monotonic()
+            key = (current_center_id(),) + args if per_center else args
+            hit = store.get(key)
+            if hit and hit[0] == generation and hit[1] > now:
+                return hit[2]
+            value = fn(*args)
+            if len(store) >= maxsize:
+                store.clear()
+            store[key] = (generation, now + ttl, value)
+            return value
+
+        wrapper.cache_clear = store.clear
+        return wrapper
+    return decorator
+
+# -------- Watcher --------
+def _ensure_watcher():
+    """Starts the watcher thread once per process (workers fork after preload)."""
+    global _watcher_pid
+    if _watcher_pid == os.getpid():
+        return
+    with _watcher_lock:
+        if _watcher_pid == os.getpid():
+            return
+        _watcher_pid = os.getpid()
+        threading.Thread(target=_watch, name="cache-bus", daemon=True).start()
+
+def _watch():
+    use_streams = CACHE_BUS == "auto"
+    while True:
+        try:
+            if use_streams:
+                _watch_change_streams()
+            else:
+                _poll_versions()
+        except OperationFailure as e:
+            if use_streams:
+                # e.g. code 40573: change streams need a replica set
+                log.info("Change streams unavailable (%s); polling cache_versions instead", e)
+                use_streams = False
+                continue
+            log.warning("Cache bus polling failed: %s", e)
+        except PyMongoError as e:
+            log.warning("Cache bus watcher error: %s", e)
+        # Events may have been missed while disconnected.
+        _bump(*WATCHED_COLLECTIONS)
+        time.sleep(RETRY_DELAY)
+
+def _watch_change_streams():
+    pipeline = [{"$match": {"ns.coll": {"$in": list(WATCHED_COLLECTIONS)}}}]
+    with get_db().watch(pipeline) as stream:
+        # Anything written before the stream opened is covered by this bump.
+        _bump(*WATCHED_COLLECTIONS)
+        for event in stream:
+            coll = event.get("ns", {}).get("coll")
+            if coll in _generations:
+                _bump(coll)
+            elif event.get("operationType") in ("dropDatabase", "invalidate"):
+                _bump(*WATCHED_COLLECTIONS)
+
+def _poll_versions():
+    seen = {}
+    while True:
+        for doc in get_db().cache_versions.find({"_id": {"$in": list(WATCHED_COLLECTIONS)}}):
+            if seen.get(doc["_id"]) != doc.get("version"):
+                seen[doc["_id"]] = doc.get("version")
+                _bump(doc["_id"])
+        time.sleep(POLL_INTERVAL)
@@ -1,6 +1,9 @@
 import os
+import click
+from flask import g, has_app_context, has_request_context
 from flask_pymongo import PyMongo
 from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -12,10 +15,39 @@ mongo = PyMongo()
 # Registration status options used throughout the UI & CSV
 ALLOWED_STATUSES = {"pending", "registered", "waitlisted", "dropped"}
 
+# Multi-tenancy: every document in these collections carries a center_id
+# (the learning center it belongs to). Requests read and write them through
+# tenant_db(), which scopes everything to the current user's center.
+TENANT_COLLECTIONS = ("users", "classes", "assignments", "submissions", "class_registrations", "students")
+# Center for data created before centers existed, and for users without one
+DEFAULT_CENTER_ID = os.environ.get("DEFAULT_CENTER_ID", "main")
+
+# Shard keys for `flask shard-collections`. Both lead with center_id, so a
+# center's data stays in contiguous chunks, followed by student_id: the
+# hot queries (a student's submissions, drafts checks, registrations,
+# teacher tracking by student list) carry both and are routed to one shard.
+SHARD_KEYS = {
+    "submissions": {"center_id": 1, "student_id": 1},
+    "class_registrations": {"center_id": 1, "student_id": 1},
+}
+
+# Pre-tenancy indexes replaced by the center_id-prefixed ones below. The
+# unique ones would otherwise stop two centers from using the same
+# student number or e-mail.
+OBSOLETE_INDEXES = {
+    "students": ["student_id_1", "email_1", "last_name_1_first_name_1"],
+    "classes": ["created_by_1_start_date_1", "created_by_1_end_date_1",
+                "is_active_1_start_date_1", "is_active_1_end_date_1"],
+    "class_registrations": ["student_id_1_class_id_1", "class_id_1", "center_id_1_class_id_1"],
+    "submissions": ["student_id_1_assignment_id_1", "assignment_id_1"],
+}
+
 def init_app(app):
     """
     Initialize the database with the Flask app.
-    This function sets up the MongoDB connection and ensures indexes are created.
+    This function sets up the MongoDB connection and registers the
+    `flask create-indexes` command. Indexes are no longer built on every
+    worker boot; see init_indexes().
     """
     # Configure the app with MongoDB URI
     app.config['MONGO_URI'] = os.environ.get('MONGO_URI')
@@ -30,24 +62,226 @@ def init_app(app):
     # For debugging purposes, print the URI to the console on startup
     print(f"INFO: Connecting to MongoDB with URI: {app.config.get('MONGO_URI')}")
 
-    # Initialize database indexes
-    with app.app_context():
+    @app.cli.command("create-indexes")
+    def create_indexes_command():
+        """Create (or confirm) all MongoDB indexes."""
         init_indexes()
+        print("INFO: Indexes are up to date.")
+
+    @app.cli.command("shard-collections")
+    def shard_collections_command():
+        """Shard the large per-center collections (run against mongos)."""
+        for name, key in shard_collections():
+            click.echo(f"{name}: sharded on {key}")
 
 def init_indexes():
     """
     Create necessary indexes for the MongoDB collections.
+    Run once per deploy via `flask create-indexes`, or once in the gunicorn
+    master when CREATE_INDEXES_ON_STARTUP is set (see gunicorn.conf.py).
     """
-    # Students collection indexes
-    mongo.db.students.create_index([("student_id", ASCENDING)], unique=True, sparse=True)
-    mongo.db.students.create_index([("email", ASCENDING)], unique=True, sparse=True)
-    mongo.db.students.create_index([("last_name", ASCENDING), ("first_name", ASCENDING)])
+    db = mongo.db
+    # Unique keys are only unique within a center; documents without the
+    # field (or with null) are left out of the index rather than colliding.
+    db.students.create_index([("center_id", ASCENDING), ("student_id", ASCENDING)], unique=True,
+                             partialFilterExpression={"student_id": {"$type": "string"}})
+    db.students.create_index([("center_id", ASCENDING), ("email", ASCENDING)], unique=True,
+                             partialFilterExpression={"email": {"$type": "string"}})
+    db.students.create_index([("center_id", ASCENDING), ("last_name", ASCENDING), ("first_name", ASCENDING)])
+    # Users: login looks up by e-mail before the center is known
+    db.users.create_index([("email", ASCENDING)])
+    db.users.create_index([("center_id", ASCENDING), ("role", ASCENDING)])
+    # Classes: date-range indexes for the schedule month view (teacher and public scopes)
+    db.classes.create_index([("center_id", ASCENDING), ("created_by", ASCENDING), ("start_date", ASCENDING)])
+    db.classes.create_index([("center_id", ASCENDING), ("created_by", ASCENDING), ("end_date", ASCENDING)])
+    db.classes.create_index([("center_id", ASCENDING), ("is_active", ASCENDING), ("start_date", ASCENDING)])
+    db.classes.create_index([("center_id", ASCENDING), ("is_active", ASCENDING), ("end_date", ASCENDING)])
+    # Assignments: the teacher dashboard and student views
+    db.assignments.create_index([("center_id", ASCENDING), ("created_by", ASCENDING)])
+    db.assignments.create_index([("center_id", ASCENDING), ("assigned_to_classes", ASCENDING)])
+    # Class registrations: one per (student, class); also looked up per class
+    # for tracking, fan-out updates and the waitlist queue (oldest first).
+    # The unique key starts with the shard key, as sharded unique indexes must.
+    _ensure_unique(db.class_registrations, "center_id_1_student_id_1_class_id_1")
+    db.class_registrations.create_index([("center_id", ASCENDING), ("student_id", ASCENDING), ("class_id", ASCENDING)],
+                                        unique=True)
+    db.class_registrations.create_index([("center_id", ASCENDING), ("class_id", ASCENDING),
+                                         ("status", ASCENDING), ("waitlisted_at", ASCENDING)])
+    # Submissions: per-student lookups (dashboard, re-submission check) and per-assignment analysis
+    db.submissions.create_index([("center_id", ASCENDING), ("student_id", ASCENDING), ("assignment_id", ASCENDING)])
+    db.submissions.create_index([("center_id", ASCENDING), ("assignment_id", ASCENDING)])
+    # Submission drafts: one per (student, assignment); every autosave matches on this key
+    db.submission_drafts.create_index([("student_id", ASCENDING), ("assignment_id", ASCENDING)], unique=True)
+    # Export jobs: removed once expired (their files are purged by exports.purge_expired_exports)
+    db.export_jobs.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+
+    for collection, names in OBSOLETE_INDEXES.items():
+        existing = db[collection].index_information()
+        for name in names:
+            if name in existing:
+                db[collection].drop_index(name)
     # Optional: Add indexes for parent names/phones if needed
     # mongo.db.students.create_index([("dad_name", ASCENDING)])
     # mongo.db.students.create_index([("mom_name", ASCENDING)])
 
+def _ensure_unique(collection, name):
+    """Drops index `name` if it exists without unique, so it can be rebuilt as unique."""
+    info = collection.index_information().get(name)
+    if info and not info.get("unique"):
+        collection.drop_index(name)
+
+def shard_collections():
+    """
+    Enables sharding for the database and shards SHARD_KEYS' collections.
+    The shard-key indexes are created by init_indexes(). Returns the
+    (collection, key) pairs sharded; on a non-sharded deployment, raises.
+    """
+    db = mongo.db
+    admin = mongo.cx.admin
+    if admin.command("hello").get("msg") != "isdbgrid":
+        raise click.ClickException("Not connected to mongos; sharding needs a sharded cluster.")
+    init_indexes()
+    try:
+        admin.command("enableSharding", db.name)
+    except OperationFailure as e:
+        if e.code != 23:  # AlreadyInitialized
+            raise
+    done = []
+    for name, key in SHARD_KEYS.items():
+        admin.command("shardCollection", f"{db.name}.{name}", key=key)
+        done.append((name, key))
+    return done
+
+def reconnect(app):
+    """
+    Replaces the MongoClient with a new, not yet connected one. For forked
+    workers: the client inherited from the parent is dropped without
+    closing it, since its sockets still belong to the parent.
+    """
+    mongo.init_app(app)
+
 def get_db():
     """
     Returns the MongoDB database instance.
     """
-    return mongo.db
\ No newline at end of file
+    return mongo.db
+
+# -------- Tenancy --------
+def current_center_id():
+    """
+    The center the current work belongs to: g.center_id if set (background
+    jobs set it), else the logged-in user's center, else DEFAULT_CENTER_ID.
+    """
+    if has_app_context() and g.get("center_id"):
+        return g.center_id
+    center = None
+    if has_request_context():
+        from flask_login import current_user
+        if current_user and current_user.is_authenticated:
+            center = getattr(current_user, "center_id", None)
+        if center:
+            g.center_id = center
+    return center or DEFAULT_CENTER_ID
+
+def tenant_db(center_id=None):
+    """
+    The database scoped to one center (by default the current one). The
+    collections in TENANT_COLLECTIONS come back as TenantCollection; any
+    other collection is returned unchanged.
+    """
+    return TenantDatabase(mongo.db, center_id or current_center_id())
+
+class TenantDatabase:
+    def __init__(self, db, center_id):
+        self.db = db
+        self.center_id = center_id
+
+    def __getitem__(self, name):
+        if name in TENANT_COLLECTIONS:
+            return TenantCollection(self.db[name], self.center_id)
+        return self.db[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+class TenantCollection:
+    """
+    A collection with center_id added to every filter, inserted document
+    and aggregation. Only the attributes in UNSCOPED pass through to the
+    raw collection; bulk_write callers add center_id to their ops
+    themselves. Anything else (watch, map-reduce, ...) raises
+    AttributeError rather than silently reading across centers; use
+    .collection for deliberate unscoped access.
+    """
+    UNSCOPED = frozenset({"name", "full_name", "database", "bulk_write", "create_index",
+                          "create_indexes", "index_information", "list_indexes", "drop_index"})
+
+    def __init__(self, collection, center_id):
+        self.collection = collection
+        self.center_id = center_id
+
+    def __getattr__(self, name):
+        if name not in self.UNSCOPED:
+            raise AttributeError(f"TenantCollection has no center-scoped {name!r}")
+        return getattr(self.collection, name)
+
+    def scope(self, filter=None):
+        return dict(filter or {}, center_id=self.center_id)
+
+    def stamp(self, doc):
+        doc["center_id"] = self.center_id
+        return doc
+
+    def find(self, filter=None, *args, **kwargs):
+        return self.collection.find(self.scope(filter), *args, **kwargs)
+
+    def find_one(self, filter=None, *args, **kwargs):
+        return self.collection.find_one(self.scope(filter), *args, **kwargs)
+
+    def find_one_or_404(self, filter=None, *args, **kwargs):
+        return self.collection.find_one_or_404(self.scope(filter), *args, **kwargs)
+
+    def count_documents(self, filter, **kwargs):
+        return self.collection.count_documents(self.scope(filter), **kwargs)
+
+    def estimated_document_count(self, **kwargs):
+        # Collection metadata can't be filtered; count this center's documents instead.
+        return self.collection.count_documents(self.scope(), **kwargs)
+
+    def insert_one(self, document, **kwargs):
+        return self.collection.insert_one(self.stamp(document), **kwargs)
+
+    def insert_many(self, documents, **kwargs):
+        return self.collection.insert_many([self.stamp(d) for d in documents], **kwargs)
+
+    def update_one(self, filter, update, **kwargs):
+        return self.collection.update_one(self.scope(filter), update, **kwargs)
+
+    def update_many(self, filter, update, **kwargs):
+        return self.collection.update_many(self.scope(filter), update, **kwargs)
+
+    def delete_one(self, filter, **kwargs):
+        return self.collection.delete_one(self.scope(filter), **kwargs)
+
+    def delete_many(self, filter, **kwargs):
+        return self.collection.delete_many(self.scope(filter), **kwargs)
+
+    def find_one_and_update(self, filter, update, *args, **kwargs):
+        return self.collection.find_one_and_update(self.scope(filter), update, *args, **kwargs)
+
+    def find_one_and_replace(self, filter, replacement, *args, **kwargs):
+        return self.collection.find_one_and_replace(self.scope(filter), self.stamp(replacement), *args, **kwargs)
+
+    def find_one_and_delete(self, filter, *args, **kwargs):
+        return self.collection.find_one_and_delete(self.scope(filter), *args, **kwargs)
+
+    def replace_one(self, filter, replacement, **kwargs):
+        return self.collection.replace_one(self.scope(filter), self.stamp(replacement), **kwargs)
+
+    def distinct(self, key, filter=None, **kwargs):
+        return self.collection.distinct(key, self.scope(filter), **kwargs)
+
+    def aggregate(self, pipeline, **kwargs):
+        return self.collection.aggregate([{"$match": {"center_id": self.center_id}}] + list(pipeline), **kwargs)
\ No newline at end of file
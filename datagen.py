@@ -0,0 +1,322 @@
+"""
+Synthetic data generator: `flask generate-data`.
+
+Builds realistic, referentially consistent data for one or more learning
+centers: teachers and students (users), classes, assignments with mixed
+question types, class_registrations (capacity-aware, with waitlists and
+drops), submissions, and each center's teacher `students` roster.
+
+Output is deterministic: the same seed and options always give the same
+documents, _ids included (only the bcrypt salt of the shared password
+hash differs), so a dataset can be rebuilt exactly for
+before/after profiling. Each center draws from its own random stream.
+Documents are written with unordered insert_many batches, and indexes
+are built once the data is loaded.
+
+    flask generate-data --centers 2 --students 5000             # ~145k documents
+    flask generate-data --centers 14 --students 5000 --replace  # ~1M documents
+
+Every generated user can log in with --password (default "password"),
+e.g. teacher1@gen-1.example.com or student1@gen-1.example.com.
+"""
+import calendar
+import random
+import struct
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+import click
+from bson import ObjectId
+from flask_bcrypt import generate_password_hash
+from database import get_db, init_indexes, TENANT_COLLECTIONS
+from cache_bus import notify, WATCHED_COLLECTIONS
+from question_gen import StubBackend, QUESTION_TYPES
+
+DEFAULT_SEED = 42
+INSERT_BATCH_SIZE = 5000
+# Fixed start of the generated timeline, so reruns produce identical dates and _ids
+EPOCH = datetime(2025, 1, 6)
+
+FIRST_NAMES = ("Ava", "Ben", "Chloe", "Daniel", "Emma", "Farhan", "Grace", "Hiro", "Isla", "Jamal",
+               "Kai", "Lena", "Mateo", "Nora", "Omar", "Priya", "Quinn", "Rosa", "Sam", "Tariq",
+               "Uma", "Victor", "Wen", "Ximena", "Yusuf", "Zoe")
+LAST_NAMES = ("Nguyen", "Smith", "Garcia", "Kim", "Patel", "Johnson", "Lee", "Martinez", "Brown", "Chen",
+              "Davis", "Lopez", "Wilson", "Khan", "Anderson", "Tanaka", "Thomas", "Silva", "Moore", "Singh")
+SUBJECTS = ("Algebra 1", "Algebra 2", "Geometry", "Pre-Calculus", "Calculus", "AMC 8", "AMC 10",
+            "Statistics", "Number Theory", "Math Olympiad")
+TERMS = (("Spring", 0), ("Summer", 20), ("Fall", 34))  # (name, start week)
+CAPACITIES = (None, 12, 20, 30, 50)
+
+
+class _Writer:
+    """Buffers documents per collection and writes them in unordered insert_many batches."""
+
+    def __init__(self, db, batch_size):
+        self.db = db
+        self.batch_size = batch_size
+        self.buffers = {}
+        self.counts = Counter()
+
+    def add(self, collection, doc):
+        buf = self.buffers.setdefault(collection, [])
+        buf.append(doc)
+        if len(buf) >= self.batch_size:
+            self.flush(collection)
+
+    def flush(self, collection=None):
+        for name in [collection] if collection else list(self.buffers):
+            buf = self.buffers.get(name)
+            if buf:
+                self.db[name].insert_many(buf, ordered=False)
+                self.counts[name] += len(buf)
+                buf.clear()
+
+
+class CenterGenerator:
+    """Generates one center's data into a _Writer."""
+
+    def __init__(self, writer, seed, center_id, password_hash, *, teachers, students, classes_per_teacher,
+                 assignments_per_class, questions, registrations_per_student, submission_rate):
+        self.out = writer
+        self.rng = random.Random(f"{seed}:{center_id}")
+        self.center_id = center_id
+        self.password_hash = password_hash
+        self.teachers = teachers
+        self.students = students
+        self.classes_per_teacher = classes_per_teacher
+        self.assignments_per_class = assignments_per_class
+        self.questions = questions
+        self.registrations_per_student = registrations_per_student
+        self.submission_rate = submission_rate
+        self.questions_backend = StubBackend()
+
+    def oid(self, when):
+        """A reproducible ObjectId whose timestamp is `when`."""
+        return ObjectId(struct.pack(">I", calendar.timegm(when.timetuple())) + self.rng.randbytes(8))
+
+    def when(self, start, max_days):
+        return start + timedelta(seconds=self.rng.randrange(int(max_days * 86400)))
+
+    def name(self):
+        return self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+
+    def phone(self):
+        return f"{self.rng.randrange(200, 999)}-{self.rng.randrange(200, 999)}-{self.rng.randrange(10000):04d}"
+
+    def generate(self):
+        teacher_ids = [self.user("teacher", n, *self.name()) for n in range(1, self.teachers + 1)]
+        classes = [self.make_class(t) for t in teacher_ids for _ in range(self.classes_per_teacher)]
+        for teacher_id in teacher_ids:
+            self.assignment(teacher_id, None)  # each teacher also has an unassigned draft
+        # A few popular classes draw most registrations, so some fill up and waitlist.
+        weights = [self.rng.paretovariate(1.5) for _ in classes]
+        students = [self.student(n, classes, weights) for n in range(1, self.students + 1)]
+        for c in classes:
+            self.allocate_seats(c)
+        for s in students:
+            self.enroll(s)
+        # Written last, once seats_taken is known
+        for c in classes:
+            self.out.add("classes", {k: v for k, v in c.items() if k not in ("assignments", "registrations")})
+
+    # -------- Documents --------
+    def user(self, role, n, first, last):
+        created = self.when(EPOCH, 30)
+        _id = self.oid(created)
+        self.out.add("users", {
+            "_id": _id, "center_id": self.center_id,
+            "name": f"{first} {last}", "email": f"{role}{n}@{self.center_id}.example.com",
+            "password_hash": self.password_hash, "role": role, "enrolled_classes": [],
+        })
+        return _id
+
+    def make_class(self, teacher_id):
+        term, week = self.rng.choice(TERMS)
+        start = EPOCH + timedelta(weeks=week + self.rng.randrange(4))
+        created = start - timedelta(days=self.rng.randrange(14, 45))
+        doc = {
+            "_id": self.oid(created), "center_id": self.center_id,
+            "name": f"{self.rng.choice(SUBJECTS)} - {term} {EPOCH.year} ({self.rng.randrange(100, 999)})",
+            "start_date": start, "end_date": start + timedelta(weeks=self.rng.choice((8, 10, 12, 16))),
+            "fee": float(self.rng.choice((149, 199, 249, 299, 349, 499))),
+            "capacity": self.rng.choice(CAPACITIES), "seats_taken": 0,
+            "is_active": self.rng.random() < 0.85,
+            "created_by": teacher_id, "created_at": created,
+        }
+        doc["assignments"] = [self.assignment(teacher_id, doc) for _ in range(self.assignments_per_class)]
+        return doc
+
+    def assignment(self, teacher_id, class_doc):
+        created = self.when(class_doc["start_date"], 60) if class_doc else self.when(EPOCH, 300)
+        _id = self.oid(created)
+        counts = Counter(self.rng.choice(QUESTION_TYPES) for _ in range(self.questions))
+        questions = [q for q_type, n in counts.items()
+                     for q in self.questions_backend.generate(f"{_id}:{q_type}", n, q_type)]
+        self.rng.shuffle(questions)
+        doc = {
+            "_id": _id, "center_id": self.center_id,
+            "title": f"Practice Set {self.rng.randrange(1, 60)}", "questions": questions,
+            "created_by": teacher_id, "created_at": created,
+            "assigned_to_classes": [class_doc["_id"]] if class_doc else [],
+        }
+        self.out.add("assignments", doc)
+        return doc
+
+    def student(self, n, classes, weights):
+        """Creates the student's user and picks their classes; statuses are set by allocate_seats()."""
+        first, last = self.name()
+        student = {
+            "n": n, "first": first, "last": last, "_id": self.user("student", n, first, last),
+            "email": f"student{n}@{self.center_id}.example.com",
+            "skill": self.rng.betavariate(5, 2),  # chance of answering a question correctly
+        }
+        count = min(len(classes), max(1, round(self.rng.gauss(self.registrations_per_student, 1))))
+        chosen = {id(c): c for c in self.rng.choices(classes, weights=weights, k=count * 2)}
+        student["registrations"] = [(c, self.registration(student, c)) for c in list(chosen.values())[:count]]
+        return student
+
+    def registration(self, student, class_doc):
+        when = class_doc["created_at"] + timedelta(hours=self.rng.randrange(1, 24 * 14))
+        doc = {
+            "_id": self.oid(when), "center_id": self.center_id,
+            "student_id": student["_id"], "class_id": class_doc["_id"], "class_name": class_doc["name"],
+            "student_name": f"{student['first']} {student['last']}", "contact_email": student["email"],
+            "contact_phone": self.phone(), "status": None, "registration_date": when,
+        }
+        class_doc.setdefault("registrations", []).append(doc)
+        return doc
+
+    def allocate_seats(self, class_doc):
+        """Seats go to the earliest registrations, as registration.register() gives them out."""
+        for doc in sorted(class_doc.get("registrations", ()), key=lambda d: (d["registration_date"], d["_id"])):
+            when = doc["registration_date"]
+            if class_doc["capacity"] is not None and class_doc["seats_taken"] >= class_doc["capacity"]:
+                doc["status"] = "waitlisted"
+                doc["waitlisted_at"] = when
+            elif self.rng.random() < 0.05:
+                doc["status"] = "dropped"
+                doc["dropped_at"] = when + timedelta(days=self.rng.randrange(1, 20))
+            else:
+                doc["status"] = "registered"
+                class_doc["seats_taken"] += 1
+
+    def enroll(self, student):
+        """Writes the student's registrations, their submissions and the teacher-side roster entry."""
+        registered_names = []
+        for class_doc, doc in student["registrations"]:
+            self.out.add("class_registrations", doc)
+            if doc["status"] == "registered":
+                registered_names.append(class_doc["name"])
+                for a in class_doc["assignments"]:
+                    if self.rng.random() < self.submission_rate:
+                        self.submission(student["_id"], a, student["skill"])
+
+        first, last = student["first"], student["last"]
+        self.out.add("students", {
+            "_id": self.oid(EPOCH), "center_id": self.center_id, "student_id": f"{student['n']:06d}",
+            "first_name": first, "last_name": last, "email": student["email"],
+            "grade": self.rng.randrange(5, 13), "classes": registered_names,
+            "reg_status": "registered" if registered_names else self.rng.choice(("pending", "waitlisted")),
+            "notes": "",
+            "dad_name": f"{self.rng.choice(FIRST_NAMES)} {last}", "dad_phone": self.phone(),
+            "mom_name": f"{self.rng.choice(FIRST_NAMES)} {last}", "mom_phone": self.phone(),
+            "created_at": EPOCH, "updated_at": EPOCH,
+        })
+
+    def submission(self, student_id, assignment, skill):
+        submitted = assignment["created_at"] + timedelta(minutes=self.rng.randrange(10, 60 * 24 * 10))
+        answers, score = [], 0
+        for q in assignment["questions"]:
+            correct = self.rng.random() < skill
+            if q["type"] == "multiple_choice":
+                wrong = [i for i in range(len(q["options"])) if i != q["answer"]]
+                answer = str(q["answer"] if correct or not wrong else self.rng.choice(wrong))
+            else:
+                answer = q["answer"] if correct else str(int(q["answer"]) + self.rng.randrange(1, 10))
+            score += correct
+            answers.append({"question_text": q["text"], "student_answer": answer, "is_correct": correct})
+        self.out.add("submissions", {
+            "_id": self.oid(submitted), "center_id": self.center_id,
+            "assignment_id": assignment["_id"], "student_id": student_id, "submitted_at": submitted,
+            "answers": answers, "score": score, "total_questions": len(assignment["questions"]),
+        })
+
+
+def delete_centers(db, center_ids):
+    """
+    Deletes the centers' documents, plus the data derived from them that
+    carries no center_id: item_analysis reports and submission_drafts of
+    their assignments and students.
+    """
+    for center_id in center_ids:
+        assignment_ids = [d["_id"] for d in db.assignments.find({"center_id": center_id}, {"_id": 1})]
+        student_ids = [d["_id"] for d in db.users.find({"center_id": center_id, "role": "student"}, {"_id": 1})]
+        derived = {
+            "item_analysis": db.item_analysis.delete_many({"_id": {"$in": assignment_ids}}).deleted_count,
+            "submission_drafts": db.submission_drafts.delete_many({"$or": [
+                {"assignment_id": {"$in": assignment_ids}}, {"student_id": {"$in": student_ids}}]}).deleted_count,
+        }
+        for name, deleted in derived.items():
+            if deleted:
+                click.echo(f"{center_id}: deleted {deleted} {name}")
+        for name in TENANT_COLLECTIONS:
+            deleted = db[name].delete_many({"center_id": center_id}).deleted_count
+            if deleted:
+                click.echo(f"{center_id}: deleted {deleted} {name}")
+
+
+def register_commands(app):
+    """Adds `flask generate-data` to the app's CLI."""
+
+    @app.cli.command("generate-data")
+    @click.option("--seed", default=DEFAULT_SEED, show_default=True, help="Same seed, same dataset.")
+    @click.option("--centers", default=1, show_default=True, help="Number of centers to generate.")
+    @click.option("--center-prefix", default="gen-", show_default=True, help="Center ids are <prefix>1, <prefix>2, ...")
+    @click.option("--teachers", default=None, type=int, help="Teachers per center [default: one per 50 students].")
+    @click.option("--students", default=1000, show_default=True, help="Students per center.")
+    @click.option("--classes-per-teacher", default=4, show_default=True)
+    @click.option("--assignments-per-class", default=6, show_default=True)
+    @click.option("--questions", default=10, show_default=True, help="Questions per assignment.")
+    @click.option("--registrations-per-student", default=3, show_default=True, help="Average classes per student.")
+    @click.option("--submission-rate", default=0.8, show_default=True, help="Share of assignments each registered student submits.")
+    @click.option("--password", default="password", show_default=True, help="Password for every generated user.")
+    @click.option("--batch-size", default=INSERT_BATCH_SIZE, show_default=True, help="Documents per insert_many.")
+    @click.option("--replace", is_flag=True, help="Delete the generated centers' existing data first.")
+    @click.option("--indexes/--no-indexes", default=True, show_default=True, help="Build indexes after loading.")
+    def generate_data_command(seed, centers, center_prefix, teachers, students, classes_per_teacher,
+                              assignments_per_class, questions, registrations_per_student, submission_rate,
+                              password, batch_size, replace, indexes):
+        """Generate a reproducible synthetic dataset for local profiling."""
+        db = get_db()
+        teachers = teachers or max(1, students // 50)
+        center_ids = [f"{center_prefix}{n}" for n in range(1, centers + 1)]
+        if replace:
+            delete_centers(db, center_ids)
+        elif db.users.find_one({"center_id": {"$in": center_ids}}, {"_id": 1}):
+            raise click.ClickException(f"Centers {', '.join(center_ids)} already have data; use --replace.")
+
+        password_hash = generate_password_hash(password).decode("utf-8")  # hashed once, shared by all users
+        writer = _Writer(db, batch_size)
+        started = time.perf_counter()
+        for center_id in center_ids:
+            CenterGenerator(writer, seed, center_id, password_hash,
+                            teachers=teachers, students=students, classes_per_teacher=classes_per_teacher,
+                            assignments_per_class=assignments_per_class, questions=questions,
+                            registrations_per_student=registrations_per_student,
+                            submission_rate=submission_rate).generate()
+            writer.flush()
+            click.echo(f"{center_id}: {sum(writer.counts.values())} documents so far "
+                       f"({time.perf_counter() - started:.1f}s)")
+        elapsed = time.perf_counter() - started
+
+        for name, n in sorted(writer.counts.items()):
+            click.echo(f"  {name:<20}{n:>10}")
+        total = sum(writer.counts.values())
+        click.echo(f"Inserted {total} documents in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f}/s)")
+        notify(*WATCHED_COLLECTIONS)  # running workers may have cached the old data
+        if indexes:
+            t0 = time.perf_counter()
+            init_indexes()
+            click.echo(f"Indexes built in {time.perf_counter() - t0:.1f}s")
+        click.echo(f"Log in as teacher1@{center_ids[0]}.example.com or student1@{center_ids[0]}.example.com "
+                   f"with password '{password}'.")
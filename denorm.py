@@ -0,0 +1,88 @@
+"""
+Registry of denormalized fields.
+
+Some documents keep copies of fields from other collections so read paths
+can skip joins (e.g. class_registrations.class_name). Declare each copy
+here once. After a source document changes, call `propagate()` with the
+new values to update every dependent copy. Copies are only looked for in
+the current center (see database.tenant_db).
+"""
+from collections import namedtuple
+import background
+from database import tenant_db
+
+DenormalizedField = namedtuple(
+    "DenormalizedField",
+    ["source_collection", "source_field", "target_collection", "target_field", "foreign_key"],
+)
+
+# Fan-outs touching more documents than this run on the background pool.
+BACKGROUND_THRESHOLD = 500
+# Documents per update_many when fanning out.
+FANOUT_BATCH_SIZE = 1000
+
+_registry = []
+
+def register(source_collection, source_field, target_collection, target_field, foreign_key):
+    """
+    Declares that target_collection.target_field copies
+    source_collection.source_field, joined on target.foreign_key == source._id.
+    """
+    _registry.append(DenormalizedField(source_collection, source_field,
+                                       target_collection, target_field, foreign_key))
+
+def dependents(source_collection, fields=None):
+    """Returns registered copies of source_collection fields (optionally only `fields`)."""
+    return [d for d in _registry
+            if d.source_collection == source_collection
+            and (fields is None or d.source_field in fields)]
+
+def _stale_filter(dep, source_id, value):
+    return {dep.foreign_key: source_id, dep.target_field: {"$ne": value}}
+
+def fan_out(dep, source_id, batch_size=FANOUT_BATCH_SIZE):
+    """
+    Updates every stale copy of one field, batch_size documents per
+    update_many so a large fan-out doesn't hold one long write. The value
+    is re-read from the source document before each batch, so when two
+    fan-outs for the same document overlap (e.g. two quick renames), the
+    last batches write the current value whichever job finishes last.
+    Returns the number of documents modified.
+    """
+    db = tenant_db()
+    source, target = db[dep.source_collection], db[dep.target_collection]
+    modified = 0
+    while True:
+        doc = source.find_one({"_id": source_id}, {dep.source_field: 1})
+        if doc is None:
+            return modified  # deleted since; nothing to copy
+        value = doc.get(dep.source_field)
+        filt = _stale_filter(dep, source_id, value)
+        ids = [d["_id"] for d in target.find(filt, {"_id": 1}).limit(batch_size)]
+        if not ids:
+            return modified
+        result = target.update_many({"_id": {"$in": ids}, **filt},
+                                    {"$set": {dep.target_field: value}})
+        modified += result.modified_count
+
+def propagate(source_collection, source_id, changes):
+    """
+    Pushes changed source fields ({field: new_value}) out to their
+    denormalized copies. Small fan-outs run inline. Larger ones go to the
+    background pool, so the copies catch up shortly after the request ends.
+    """
+    db = tenant_db()
+    for dep in dependents(source_collection, changes):
+        value = changes[dep.source_field]
+        stale = db[dep.target_collection].count_documents(
+            _stale_filter(dep, source_id, value), limit=BACKGROUND_THRESHOLD + 1)
+        if not stale:
+            continue
+        if stale > BACKGROUND_THRESHOLD:
+            background.submit(fan_out, dep, source_id)
+        else:
+            fan_out(dep, source_id)
+
+# ---- Declarations ----
+# register_class stores the class name on each registration for display.
+register("classes", "name", "class_registrations", "class_name", "class_id")
@@ -0,0 +1,355 @@
+"""
+Spreadsheet and columnar exports of students, registrations, submissions
+and the per-class gradebook (the assignment-tracking grid).
+
+Datasets are generators of row tuples read from Mongo cursors in batches,
+so an export holds one batch in memory no matter how many rows it has.
+Writers are separate from the datasets:
+
+- xlsx:    XlsxWriter in constant_memory mode (rows are flushed as written)
+- parquet: pyarrow ParquetWriter, one row group per EXPORT_BATCH_ROWS
+- arrow:   Arrow IPC stream, streamed to the client batch by batch
+
+XlsxWriter and pyarrow are imported only when an export runs. Exports of
+more than EXPORT_BACKGROUND_ROWS[fmt] rows run as background jobs that
+write to EXPORT_FOLDER. xlsx is far slower to write than the columnar
+formats, so its threshold is much lower.
+
+Background exports are kept for EXPORT_RETENTION_HOURS: the job documents
+carry an expires_at that a TTL index removes, and each new job deletes
+export files older than that from EXPORT_FOLDER.
+"""
+import io
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from bson import ObjectId
+import background
+from database import get_db, tenant_db
+from registration import ACTIVE_FILTER
+
+EXPORT_FORMATS = ("xlsx", "parquet", "arrow")
+EXPORT_BATCH_ROWS = 5000
+# Rows above which an export runs in the background, per format
+EXPORT_BACKGROUND_ROWS = {"xlsx": 5000, "parquet": 50000, "arrow": 50000}
+EXPORT_FOLDER = os.environ.get(
+    "EXPORT_FOLDER",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "exports"))
+EXPORT_RETENTION = timedelta(hours=int(os.environ.get("EXPORT_RETENTION_HOURS", "24")))
+
+MIMETYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+class ExportUnavailable(RuntimeError):
+    """Raised when the library needed for a format isn't installed."""
+
+# -------- Datasets --------
+def _cell(value):
+    """Normalizes Mongo values for spreadsheet/columnar output."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, list):
+        return "|".join(str(v) for v in value)
+    return value
+
+def _teacher_class_ids(db, teacher_id):
+    return [c["_id"] for c in db.classes.find({"created_by": ObjectId(teacher_id)}, {"_id": 1})]
+
+# Columns are (name, kind); kind is one of "string", "int", "float", "datetime"
+# and fixes the column type in Parquet/Arrow output.
+STUDENT_COLUMNS = [
+    ("student_id", "string"), ("first_name", "string"), ("last_name", "string"),
+    ("email", "string"), ("grade", "int"), ("classes", "string"),
+    ("reg_status", "string"), ("notes", "string"),
+    ("dad_name", "string"), ("dad_phone", "string"), ("mom_name", "string"), ("mom_phone", "string"),
+    ("updated_at", "datetime"), ("created_at", "datetime"),
+]
+
+def _doc_rows(columns, cursor):
+    names = [name for name, _ in columns]
+    return (tuple(_cell(d.get(n)) for n in names) for d in cursor)
+
+def students_dataset(db, teacher_id, class_id=None):
+    cursor = (db.students.find({}, {n: 1 for n, _ in STUDENT_COLUMNS})
+              .sort([("last_name", 1), ("first_name", 1)])
+              .batch_size(EXPORT_BATCH_ROWS))
+    return STUDENT_COLUMNS, _doc_rows(STUDENT_COLUMNS, cursor)
+
+REGISTRATION_COLUMNS = [
+    ("class_id", "string"), ("class_name", "string"), ("student_id", "string"),
+    ("student_name", "string"), ("contact_email", "string"), ("contact_phone", "string"),
+    ("status", "string"), ("registration_date", "datetime"),
+]
+
+def registrations_dataset(db, teacher_id, class_id=None):
+    class_ids = _teacher_class_ids(db, teacher_id)
+    if class_id:
+        class_ids = [c for c in class_ids if c == ObjectId(class_id)]
+    cursor = (db.class_registrations.find({"class_id": {"$in": class_ids}},
+                                          {n: 1 for n, _ in REGISTRATION_COLUMNS})
+              .sort([("class_id", 1), ("registration_date", 1)])
+              .batch_size(EXPORT_BATCH_ROWS))
+    return REGISTRATION_COLUMNS, _doc_rows(REGISTRATION_COLUMNS, cursor)
+
+SUBMISSION_COLUMNS = [
+    ("assignment_id", "string"), ("assignment_title", "string"), ("student_id", "string"),
+    ("submitted_at", "datetime"), ("score", "int"), ("total_questions", "int"),
+]
+
+def submissions_dataset(db, teacher_id, class_id=None):
+    filt = {"created_by": ObjectId(teacher_id)}
+    if class_id:
+        filt["assigned_to_classes"] = ObjectId(class_id)
+    titles = {a["_id"]: a.get("title", "") for a in db.assignments.find(filt, {"title": 1})}
+    cursor = (db.submissions.find({"assignment_id": {"$in": list(titles)}},
+                                  {"answers": 0})
+              .sort([("assignment_id", 1), ("student_id", 1)])
+              .batch_size(EXPORT_BATCH_ROWS))
+    rows = ((str(d["assignment_id"]), titles.get(d["assignment_id"], ""), str(d["student_id"]),
+             d.get("submitted_at"), d.get("score"), d.get("total_questions"))
+            for d in cursor)
+    return SUBMISSION_COLUMNS, rows
+
+def gradebook_dataset(db, teacher_id, class_id=None):
+    """
+    The assignment-tracking grid for one class: a row per registered student,
+    a score column per assignment. Submissions are fetched per batch of students.
+    """
+    if not class_id:
+        raise ValueError("The gradebook export needs a class_id.")
+    class_id = ObjectId(class_id)
+    if class_id not in _teacher_class_ids(db, teacher_id):
+        raise PermissionError("Not your class.")
+    assignments = list(db.assignments.find({"assigned_to_classes": class_id}, {"title": 1})
+                       .sort("created_at", 1))
+    assignment_ids = [a["_id"] for a in assignments]
+    columns = [("student_id", "string"), ("student_name", "string")]
+    seen = set()
+    for a in assignments:
+        title = a.get("title") or str(a["_id"])
+        if title in seen:  # column names must be unique
+            title = f"{title} ({a['_id']})"
+        seen.add(title)
+        columns.append((title, "int"))
+
+    def rows():
+        batch = []
+        cursor = (db.class_registrations.find({"class_id": class_id, **ACTIVE_FILTER},
+                                              {"student_id": 1, "student_name": 1})
+                  .sort("student_name", 1).batch_size(EXPORT_BATCH_ROWS))
+        for reg in cursor:
+            batch.append(reg)
+            if len(batch) >= EXPORT_BATCH_ROWS:
+                yield from _gradebook_rows(db, batch, assignment_ids)
+                batch = []
+        if batch:
+            yield from _gradebook_rows(db, batch, assignment_ids)
+
+    return columns, rows()
+
+def _gradebook_rows(db, registrations, assignment_ids):
+    scores = {
+        (s["student_id"], s["assignment_id"]): s.get("score")
+        for s in db.submissions.find(
+            {"student_id": {"$in": [r["student_id"] for r in registrations]},
+             "assignment_id": {"$in": assignment_ids}},
+            {"student_id": 1, "assignment_id": 1, "score": 1})
+    }
+    for r in registrations:
+        yield (str(r["student_id"]), r.get("student_name", ""),
+               *(scores.get((r["student_id"], a)) for a in assignment_ids))
+
+DATASETS = {
+    "students": students_dataset,
+    "registrations": registrations_dataset,
+    "submissions": submissions_dataset,
+    "gradebook": gradebook_dataset,
+}
+
+def estimate_rows(db, dataset, teacher_id, class_id=None):
+    """Cheap row-count estimate used to decide between inline and background exports."""
+    if dataset == "students":
+        return db.students.estimated_document_count()
+    if dataset in ("registrations", "gradebook"):
+        class_ids = [ObjectId(class_id)] if class_id else _teacher_class_ids(db, teacher_id)
+        return db.class_registrations.count_documents({"class_id": {"$in": class_ids}})
+    filt = {"created_by": ObjectId(teacher_id)}
+    if class_id:
+        filt["assigned_to_classes"] = ObjectId(class_id)
+    ids = [a["_id"] for a in db.assignments.find(filt, {"_id": 1})]
+    return db.submissions.count_documents({"assignment_id": {"$in": ids}})
+
+# -------- Writers --------
+def _batches(rows, size=EXPORT_BATCH_ROWS):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ExportUnavailable("Parquet/Arrow exports need pyarrow installed.") from e
+    return pa, pq
+
+def _coerce(value, kind):
+    # Legacy documents may hold unexpected types; anything unconvertible becomes null.
+    if value is None:
+        return None
+    try:
+        if kind == "int":
+            return int(value)
+        if kind == "float":
+            return float(value)
+    except (TypeError, ValueError):
+        return None
+    if kind == "datetime":
+        return value if isinstance(value, datetime) else None
+    return value if isinstance(value, str) else str(value)
+
+def arrow_schema(pa, columns):
+    types = {"string": pa.string(), "int": pa.int64(), "float": pa.float64(),
+             "datetime": pa.timestamp("ms")}
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+def _record_batch(pa, schema, columns, batch):
+    arrays = [
+        pa.array([_coerce(row[i], kind) for row in batch], type=schema.field(i).type)
+        for i, (_, kind) in enumerate(columns)
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def check_available(fmt):
+    """Raises ExportUnavailable up front if the library for `fmt` is missing."""
+    if fmt == "xlsx":
+        try:
+            import xlsxwriter  # noqa: F401
+        except ImportError as e:
+            raise ExportUnavailable("XLSX exports need XlsxWriter installed.") from e
+    else:
+        _import_pyarrow()
+
+def write_xlsx(columns, rows, path):
+    try:
+        import xlsxwriter
+    except ImportError as e:
+        raise ExportUnavailable("XLSX exports need XlsxWriter installed.") from e
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True, "remove_timezone": True})
+    sheet = workbook.add_worksheet("export")
+    date_format = workbook.add_format({"num_format": "yyyy-mm-dd hh:mm"})
+    sheet.write_row(0, 0, [name for name, _ in columns])
+    for r, row in enumerate(rows, start=1):
+        for c, value in enumerate(row):
+            if isinstance(value, datetime):
+                sheet.write_datetime(r, c, value, date_format)
+            elif value is not None:
+                sheet.write(r, c, value)
+    workbook.close()
+    return path
+
+def write_parquet(columns, rows, path):
+    pa, pq = _import_pyarrow()
+    schema = arrow_schema(pa, columns)
+    with pq.ParquetWriter(path, schema) as writer:
+        for batch in _batches(rows):
+            writer.write_batch(_record_batch(pa, schema, columns, batch))
+    return path
+
+def stream_arrow(columns, rows):
+    """Yields an Arrow IPC stream one record batch at a time (for streaming responses)."""
+    pa, _ = _import_pyarrow()
+    schema = arrow_schema(pa, columns)
+    buf = io.BytesIO()
+
+    def drain():
+        data = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return data
+
+    with pa.ipc.new_stream(buf, schema) as writer:
+        yield drain()  # schema header
+        for batch in _batches(rows):
+            writer.write_batch(_record_batch(pa, schema, columns, batch))
+            yield drain()
+    yield drain()  # end-of-stream marker
+
+def write_arrow(columns, rows, path):
+    with open(path, "wb") as f:
+        for chunk in stream_arrow(columns, rows):
+            f.write(chunk)
+    return path
+
+WRITERS = {"xlsx": write_xlsx, "parquet": write_parquet, "arrow": write_arrow}
+
+def export_to_file(dataset, fmt, teacher_id, class_id=None, folder=None):
+    """Writes a full export to a file and returns its path."""
+    folder = folder or tempfile.gettempdir()
+    os.makedirs(folder, exist_ok=True)
+    columns, rows = DATASETS[dataset](tenant_db(), teacher_id, class_id)
+    fd, path = tempfile.mkstemp(prefix=f"{dataset}-", suffix=f".{fmt}", dir=folder)
+    os.close(fd)
+    try:
+        return WRITERS[fmt](columns, rows, path)
+    except Exception:
+        os.remove(path)
+        raise
+
+# -------- Background jobs --------
+def start_export_job(dataset, fmt, teacher_id, class_id=None):
+    now = datetime.utcnow()
+    job_id = get_db().export_jobs.insert_one({
+        "created_by": ObjectId(teacher_id),
+        "dataset": dataset,
+        "format": fmt,
+        "class_id": ObjectId(class_id) if class_id else None,
+        "status": "pending",
+        "created_at": now,
+        "expires_at": now + EXPORT_RETENTION,
+    }).inserted_id
+    background.submit(run_export_job, job_id)
+    return job_id
+
+def run_export_job(job_id):
+    db = get_db()
+    job = db.export_jobs.find_one_and_update(
+        {"_id": job_id, "status": "pending"}, {"$set": {"status": "running"}})
+    if not job:
+        return
+    purge_expired_exports()
+    try:
+        path = export_to_file(job["dataset"], job["format"], job["created_by"],
+                              job.get("class_id"), folder=EXPORT_FOLDER)
+    except Exception as e:
+        db.export_jobs.update_one({"_id": job_id}, {"$set": {
+            "status": "error", "error": str(e), "finished_at": datetime.utcnow()}})
+        raise
+    db.export_jobs.update_one({"_id": job_id}, {"$set": {
+        "status": "done", "path": path, "finished_at": datetime.utcnow()}})
+
+def purge_expired_exports(folder=EXPORT_FOLDER):
+    """Deletes export files older than EXPORT_RETENTION. Returns how many were removed."""
+    cutoff = time.time() - EXPORT_RETENTION.total_seconds()
+    removed = 0
+    try:
+        entries = list(os.scandir(folder))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            pass  # removed by a concurrent job
+    return removed
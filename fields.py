@@ -0,0 +1,68 @@
+import math
+import re
+from datetime import datetime
+
+# Class dates are submitted by <input type="date"> in this format.
+DATE_FORMAT = "%Y-%m-%d"
+
+def parse_date(value):
+    """
+    Parses a class date into a datetime. Accepts datetimes (returned as-is),
+    'YYYY-MM-DD' strings, or empty values (returns None).
+    Raises ValueError for any other string.
+    """
+    if value is None or isinstance(value, datetime):
+        return value
+    value = value.strip()
+    if not value:
+        return None
+    return datetime.strptime(value, DATE_FORMAT)
+
+def format_date(value):
+    """
+    Formats a class date for display and for <input type="date"> values.
+    Older documents may still hold strings, which are passed through.
+    """
+    if isinstance(value, datetime):
+        return value.strftime(DATE_FORMAT)
+    return value or ""
+
+def parse_fee(value):
+    """
+    Parses a class fee into a float. Accepts numbers or strings such as
+    '299.99', '$1,200' or '' (returns None). Raises ValueError for
+    anything else, including negative, NaN and infinite fees.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = re.sub(r"[\s$,]", "", value)
+        if not value:
+            return None
+    fee = float(value)
+    if not math.isfinite(fee):
+        raise ValueError("Fee must be a number.")
+    if fee < 0:
+        raise ValueError("Fee cannot be negative.")
+    return fee
+
+def format_fee(value):
+    """Formats a fee with two decimals; legacy string fees are passed through."""
+    if isinstance(value, (int, float)):
+        return f"{value:.2f}"
+    return value or ""
+
+def parse_capacity(value):
+    """
+    Parses a class capacity into a positive int. Empty values mean
+    unlimited (returns None). Raises ValueError otherwise.
+    """
+    if value is None or isinstance(value, int):
+        return value
+    value = value.strip()
+    if not value:
+        return None
+    capacity = int(value)
+    if capacity < 1:
+        raise ValueError("Capacity must be at least 1.")
+    return capacity
@@ -0,0 +1,33 @@
+# Gunicorn settings. Used by the Dockerfile: gunicorn -c gunicorn.conf.py "app:create_app()"
+import os
+import sys
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+# The number of workers is a suggestion. Adjust based on your server's CPU cores (2-4 per core is a common rule of thumb).
+workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+
+# Import the app once in the master and fork workers from it, so each
+# worker skips the import/setup cost and shares the loaded code pages.
+# Set GUNICORN_PRELOAD=0 to load the app separately in every worker.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+def on_starting(server):
+    """
+    Runs once in the master before any worker starts, so index builds
+    happen on a single process instead of on every worker boot. Uses the
+    preloaded app (or loads it here; the workers then inherit it).
+    """
+    if os.environ.get("CREATE_INDEXES_ON_STARTUP") != "1":
+        return
+    from database import init_indexes
+    with server.app.wsgi().app_context():
+        init_indexes()
+    server.log.info("MongoDB indexes are up to date.")
+
+def post_fork(server, worker):
+    # PyMongo clients aren't fork-safe, and a closed one can't be reused.
+    # If the master loaded the app (preload, or the index build above),
+    # give this worker a fresh client instead of the inherited one.
+    database = sys.modules.get("database")
+    if database is not None and database.mongo.cx is not None:
+        database.reconnect(server.app.wsgi())
@@ -0,0 +1,109 @@
+"""
+Response middleware: compression, conditional GETs and long-lived caching
+for fingerprinted static files.
+
+- Text responses of at least COMPRESS_MIN_SIZE bytes are brotli-compressed
+  when the client accepts it and the optional `brotli` package is
+  installed, otherwise gzip-compressed.
+- Every compressible 200 response gets a weak ETag hashed from its
+  uncompressed body, unless the view already set one (e.g. from a data
+  version). A matching If-None-Match gets a bodyless 304.
+- static_url() adds a content hash to static URLs. Those URLs are served
+  with a one-year immutable Cache-Control.
+"""
+import gzip
+import hashlib
+from functools import lru_cache
+import os
+from flask import current_app, request, url_for
+
+COMPRESSIBLE_MIMETYPES = {
+    "text/html", "text/css", "text/plain", "text/csv", "text/calendar",
+    "text/javascript", "application/javascript", "application/json", "image/svg+xml",
+}
+DEFAULTS = {
+    "COMPRESS_MIN_SIZE": 500,           # bytes; smaller bodies aren't worth it
+    "COMPRESS_MAX_SIZE": 5 * 1024 * 1024,
+    "COMPRESS_GZIP_LEVEL": 6,
+    "COMPRESS_BROTLI_QUALITY": 5,
+    "STATIC_FINGERPRINT_MAX_AGE": 365 * 24 * 3600,
+}
+
+try:
+    import brotli  # optional; gzip is used when it isn't installed
+    HAVE_BROTLI = True
+except ImportError:
+    brotli = None
+    HAVE_BROTLI = False
+
+def init_app(app):
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    app.add_template_global(static_url)
+    app.after_request(_after_request)
+
+# -------- Fingerprinted static files --------
+@lru_cache(maxsize=256)
+def _file_hash(path, mtime):
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()[:12]
+
+def static_url(filename):
+    """url_for('static', ...) plus a content hash, so the URL changes whenever the file does."""
+    path = os.path.join(current_app.static_folder, filename)
+    try:
+        version = _file_hash(path, os.path.getmtime(path))
+    except OSError:
+        return url_for("static", filename=filename)
+    return url_for("static", filename=filename, v=version)
+
+# -------- After-request hook --------
+def _after_request(response):
+    config = current_app.config
+
+    if request.endpoint == "static" and request.args.get("v"):
+        response.cache_control.public = True
+        response.cache_control.max_age = config["STATIC_FINGERPRINT_MAX_AGE"]
+        response.cache_control.immutable = True
+
+    if (request.method != "GET" or response.status_code != 200
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or "Content-Encoding" in response.headers):
+        return response
+    if response.is_streamed and not response.direct_passthrough:
+        return response  # generator responses (e.g. exports) stay streamed
+    if response.direct_passthrough:
+        # send_file responses: only buffer small files
+        if not response.content_length or response.content_length > config["COMPRESS_MAX_SIZE"]:
+            return response
+        response.direct_passthrough = False
+
+    data = response.get_data()
+
+    # Conditional GET on a weak ETag of the rendered body
+    if not response.get_etag()[0]:
+        response.set_etag(hashlib.sha1(data).hexdigest(), weak=True)
+    if request.endpoint != "static" and "Cache-Control" not in response.headers:
+        # Pages are per-user: let browsers keep them, but always revalidate.
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    response.make_conditional(request)
+    if response.status_code == 304:
+        return response
+
+    response.vary.add("Accept-Encoding")
+    if len(data) < config["COMPRESS_MIN_SIZE"]:
+        return response
+
+    offered = ["br", "gzip"] if HAVE_BROTLI else ["gzip"]
+    encoding = request.accept_encodings.best_match(offered)
+    if encoding == "br":
+        body = brotli.compress(data, quality=config["COMPRESS_BROTLI_QUALITY"])
+    elif encoding == "gzip":
+        body = gzip.compress(data, compresslevel=config["COMPRESS_GZIP_LEVEL"])
+    else:
+        return response
+
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    return response
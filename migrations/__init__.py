@@ -0,0 +1,185 @@
+"""
+Versioned data migrations.
+
+Each migration lives in its own module (mNNNN_<name>.py) and defines a
+`migration` object, or a `migrations` list when one change spans several
+collections. Applied migrations are recorded in the
+`schema_migrations` collection, so `flask migrate` only runs what is new.
+
+Backfills run in batches ordered by _id. After every batch the last _id is
+saved, so an interrupted run resumes where it stopped. Writes go through
+`bulk_write`, with a pause between batches so production traffic isn't
+starved. Write errors don't stop a run, but they are counted, and a run
+that had any is not marked applied: the next `flask migrate` makes a new
+pass over the documents its filter still matches.
+"""
+import importlib
+import pkgutil
+import time
+from datetime import datetime
+import click
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from database import get_db
+from cache_bus import WATCHED_COLLECTIONS, notify
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_SLEEP_SECONDS = 0.1
+
+
+class MigrationFailed(RuntimeError):
+    """Raised when a migration finished its pass with write errors."""
+
+
+class Migration:
+    """
+    A backfill over `collection`. Subclasses set `version`, `description`,
+    `collection` and `filter` (documents still needing the change) and
+    implement `ops_for(doc)`. It returns the write ops for one document,
+    against `target_collection` (defaults to `collection`).
+    """
+    version = None
+    description = ""
+    collection = None
+    target_collection = None
+    filter = {}
+    projection = None
+
+    def ops_for(self, doc):
+        raise NotImplementedError
+
+    def count(self, db):
+        """Documents that still need migrating (used for dry runs)."""
+        return db[self.collection].count_documents(self.filter)
+
+    def after(self, db):
+        """Hook run once the backfill completes. Caches of the target collection are invalidated automatically."""
+
+
+def load_migrations():
+    """Returns all migrations in this package, sorted by version."""
+    migrations = []
+    for info in pkgutil.iter_modules(__path__):
+        if info.name.startswith("m"):
+            module = importlib.import_module(f"{__name__}.{info.name}")
+            migrations.extend(getattr(module, "migrations", None) or [module.migration])
+    return sorted(migrations, key=lambda m: m.version)
+
+
+def pending_migrations(db):
+    applied = {d["_id"] for d in db.schema_migrations.find({"applied_at": {"$exists": True}}, {"_id": 1})}
+    return [m for m in load_migrations() if m.version not in applied]
+
+
+def run_migration(db, migration, batch_size=DEFAULT_BATCH_SIZE, sleep=DEFAULT_SLEEP_SECONDS, log=print):
+    """
+    Runs one migration in resumable batches. Returns the number of
+    documents processed in this run.
+    """
+    record = db.schema_migrations.find_one_and_update(
+        {"_id": migration.version},
+        {"$setOnInsert": {"description": migration.description,
+                          "started_at": datetime.utcnow(),
+                          "processed": 0}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    last_id = record.get("last_id")
+    if last_id is not None:
+        log(f"  resuming after _id {last_id}")
+    else:
+        # A new pass; errors from a failed earlier pass are retried now.
+        db.schema_migrations.update_one({"_id": migration.version},
+                                        {"$set": {"write_errors": 0}, "$unset": {"failed_at": ""}})
+
+    source = db[migration.collection]
+    target = db[migration.target_collection or migration.collection]
+    processed = 0
+    while True:
+        filt = dict(migration.filter)
+        if last_id is not None:
+            filt["_id"] = {"$gt": last_id}
+        batch = list(source.find(filt, migration.projection).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+
+        ops = [op for doc in batch for op in (migration.ops_for(doc) or [])]
+        errors = 0
+        if ops:
+            try:
+                target.bulk_write(ops, ordered=False)
+            except BulkWriteError as e:
+                # Keep going; the errors are counted and the migration isn't marked applied.
+                errors = len(e.details.get("writeErrors", []))
+                log(f"  {errors} write errors in batch")
+
+        last_id = batch[-1]["_id"]
+        processed += len(batch)
+        db.schema_migrations.update_one(
+            {"_id": migration.version},
+            {"$set": {"last_id": last_id}, "$inc": {"processed": len(batch), "write_errors": errors}},
+        )
+        log(f"  {processed} documents processed")
+        if sleep:
+            time.sleep(sleep)
+
+    if target.name in WATCHED_COLLECTIONS:
+        notify(target.name)
+    errors = db.schema_migrations.find_one({"_id": migration.version}, {"write_errors": 1}).get("write_errors", 0)
+    if errors:
+        db.schema_migrations.update_one(
+            {"_id": migration.version},
+            {"$set": {"failed_at": datetime.utcnow()}, "$unset": {"last_id": ""}},
+        )
+        raise MigrationFailed(f"{migration.version} had {errors} write errors; "
+                              "fix them and run `flask migrate` again")
+    migration.after(db)
+    db.schema_migrations.update_one(
+        {"_id": migration.version},
+        {"$set": {"applied_at": datetime.utcnow()}, "$unset": {"last_id": ""}},
+    )
+    return processed
+
+
+def register_commands(app):
+    """Adds `flask migrate` and `flask migrate-status` to the app's CLI."""
+
+    @app.cli.command("migrate")
+    @click.option("--dry-run", is_flag=True, help="Only report how many documents each pending migration would touch.")
+    @click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True, help="Documents per bulk_write batch.")
+    @click.option("--sleep", default=DEFAULT_SLEEP_SECONDS, show_default=True, help="Seconds to pause between batches.")
+    @click.option("--only", "only", default=None, help="Run a single migration version, e.g. 0002.")
+    def migrate_command(dry_run, batch_size, sleep, only):
+        """Apply pending data migrations."""
+        db = get_db()
+        pending = [m for m in pending_migrations(db) if only is None or m.version == only]
+        if not pending:
+            click.echo("No pending migrations.")
+            return
+        for m in pending:
+            if dry_run:
+                click.echo(f"{m.version} {m.description}: {m.count(db)} documents to migrate")
+                continue
+            click.echo(f"Applying {m.version} {m.description}")
+            try:
+                processed = run_migration(db, m, batch_size=batch_size, sleep=sleep, log=click.echo)
+            except MigrationFailed as e:
+                raise click.ClickException(str(e))  # later migrations may depend on this one
+            click.echo(f"Applied {m.version} ({processed} documents)")
+
+    @app.cli.command("migrate-status")
+    def migrate_status_command():
+        """List migrations and whether they have been applied."""
+        db = get_db()
+        records = {d["_id"]: d for d in db.schema_migrations.find()}
+        for m in load_migrations():
+            rec = records.get(m.version)
+            if rec and rec.get("applied_at"):
+                state = f"applied {rec['applied_at']:%Y-%m-%d %H:%M}"
+            elif rec and rec.get("failed_at"):
+                state = f"failed {rec['failed_at']:%Y-%m-%d %H:%M} ({rec.get('write_errors', 0)} write errors)"
+            elif rec:
+                state = f"in progress ({rec.get('processed', 0)} processed)"
+            else:
+                state = "pending"
+            click.echo(f"{m.version} {m.description}: {state}")
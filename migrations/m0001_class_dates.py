@@ -0,0 +1,25 @@
+from pymongo import UpdateOne
+from fields import parse_date
+from . import Migration
+
+
+class ClassDates(Migration):
+    version = "0001"
+    description = "Convert classes.start_date/end_date strings to datetimes"
+    collection = "classes"
+    filter = {"$or": [{"start_date": {"$type": "string"}}, {"end_date": {"$type": "string"}}]}
+    projection = {"start_date": 1, "end_date": 1}
+
+    def ops_for(self, doc):
+        changes = {}
+        for field in ("start_date", "end_date"):
+            try:
+                value = parse_date(doc.get(field))
+            except ValueError:
+                continue  # leave unparseable values for manual cleanup
+            if value != doc.get(field):
+                changes[field] = value
+        return [UpdateOne({"_id": doc["_id"]}, {"$set": changes})] if changes else []
+
+
+migration = ClassDates()
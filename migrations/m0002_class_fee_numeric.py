@@ -0,0 +1,21 @@
+from pymongo import UpdateOne
+from fields import parse_fee
+from . import Migration
+
+
+class ClassFeeNumeric(Migration):
+    version = "0002"
+    description = "Convert classes.fee strings to numbers"
+    collection = "classes"
+    filter = {"fee": {"$type": "string"}}
+    projection = {"fee": 1}
+
+    def ops_for(self, doc):
+        try:
+            fee = parse_fee(doc["fee"])
+        except ValueError:
+            return []  # leave unparseable values for manual cleanup
+        return [UpdateOne({"_id": doc["_id"]}, {"$set": {"fee": fee}})]
+
+
+migration = ClassFeeNumeric()
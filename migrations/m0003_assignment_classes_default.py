@@ -0,0 +1,17 @@
+from pymongo import UpdateOne
+from . import Migration
+
+
+class AssignmentClassesDefault(Migration):
+    version = "0003"
+    description = "Default missing assignments.assigned_to_classes to []"
+    collection = "assignments"
+    filter = {"assigned_to_classes": {"$exists": False}}
+    projection = {"_id": 1}
+
+    def ops_for(self, doc):
+        return [UpdateOne({"_id": doc["_id"], "assigned_to_classes": {"$exists": False}},
+                          {"$set": {"assigned_to_classes": []}})]
+
+
+migration = AssignmentClassesDefault()
@@ -0,0 +1,33 @@
+from pymongo import UpdateMany
+from . import Migration
+
+
+class RegistrationClassNames(Migration):
+    """
+    class_registrations.class_name is copied from the class at registration
+    time and went stale whenever a class was renamed. Re-sync every copy
+    from its class; each class becomes one UpdateMany in the batch.
+    """
+    version = "0004"
+    description = "Re-sync class_registrations.class_name from classes.name"
+    collection = "classes"
+    target_collection = "class_registrations"
+    filter = {}
+    projection = {"name": 1}
+
+    def ops_for(self, doc):
+        return [UpdateMany({"class_id": doc["_id"], "class_name": {"$ne": doc.get("name")}},
+                           {"$set": {"class_name": doc.get("name")}})]
+
+    def count(self, db):
+        stale = db.class_registrations.aggregate([
+            {"$lookup": {"from": "classes", "localField": "class_id",
+                         "foreignField": "_id", "as": "cls"}},
+            {"$unwind": "$cls"},
+            {"$match": {"$expr": {"$ne": ["$class_name", "$cls.name"]}}},
+            {"$count": "n"},
+        ])
+        return next(stale, {"n": 0})["n"]
+
+
+migration = RegistrationClassNames()
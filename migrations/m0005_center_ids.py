@@ -0,0 +1,21 @@
+from pymongo import UpdateOne
+from database import DEFAULT_CENTER_ID, TENANT_COLLECTIONS
+from . import Migration
+
+
+class CenterIdBackfill(Migration):
+    """Assigns documents from before multi-tenancy to DEFAULT_CENTER_ID."""
+    filter = {"center_id": {"$exists": False}}
+    projection = {"_id": 1}
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.version = f"0005-{collection}"
+        self.description = f"Set {collection}.center_id to the default center"
+
+    def ops_for(self, doc):
+        return [UpdateOne({"_id": doc["_id"], "center_id": {"$exists": False}},
+                          {"$set": {"center_id": DEFAULT_CENTER_ID}})]
+
+
+migrations = [CenterIdBackfill(c) for c in TENANT_COLLECTIONS]
@@ -0,0 +1,33 @@
+from pymongo import UpdateOne
+from . import Migration
+
+
+class RegistrationStatus(Migration):
+    """
+    Registrations now carry a status, and (student, class) is unique.
+    Existing registrations become "registered". Duplicates left by the old
+    check-then-insert are dropped afterwards (keeping the earliest), so the
+    unique index can be built.
+    """
+    version = "0006"
+    description = "Default class_registrations.status to registered and remove duplicates"
+    collection = "class_registrations"
+    filter = {"status": {"$exists": False}}
+    projection = {"_id": 1}
+
+    def ops_for(self, doc):
+        return [UpdateOne({"_id": doc["_id"], "status": {"$exists": False}},
+                          {"$set": {"status": "registered"}})]
+
+    def after(self, db):
+        duplicates = db.class_registrations.aggregate([
+            {"$sort": {"_id": 1}},
+            {"$group": {"_id": {"center_id": "$center_id", "student_id": "$student_id", "class_id": "$class_id"},
+                        "ids": {"$push": "$_id"}, "n": {"$sum": 1}}},
+            {"$match": {"n": {"$gt": 1}}},
+        ], allowDiskUse=True)
+        for group in duplicates:
+            db.class_registrations.delete_many({"_id": {"$in": group["ids"][1:]}})
+
+
+migration = RegistrationStatus()
@@ -0,0 +1,32 @@
+from pymongo import UpdateOne
+from database import get_db
+from . import Migration
+
+
+class ClassSeats(Migration):
+    """
+    Classes get a capacity (None: unlimited) and a seats_taken counter,
+    counted from their registrations. Runs once; to repair counters
+    later, use `flask recount-seats`.
+    """
+    version = "0007"
+    description = "Backfill classes.capacity and classes.seats_taken"
+    collection = "classes"
+    filter = {}
+    projection = {"_id": 1, "center_id": 1, "capacity": 1}
+
+    def ops_for(self, doc):
+        # Counted per class on the (center_id, class_id, status) index
+        taken = get_db().class_registrations.count_documents({
+            "center_id": doc.get("center_id"), "class_id": doc["_id"],
+            "status": {"$nin": ["waitlisted", "dropped"]}})
+        fields = {"seats_taken": taken}
+        if "capacity" not in doc:
+            fields["capacity"] = None
+        return [UpdateOne({"_id": doc["_id"]}, {"$set": fields})]
+
+    def count(self, db):
+        return db.classes.count_documents({"seats_taken": {"$exists": False}})
+
+
+migration = ClassSeats()
@@ -0,0 +1,242 @@
+"""
+Per-request timing breakdowns, an on-demand profiler and a /metrics endpoint.
+
+Every request's wall time is split into:
+- db: MongoDB commands, timed by a pymongo CommandListener;
+- template: Jinja rendering, between the before_render_template and
+  template_rendered signals;
+- bcrypt: password hashing and checking, via span("bcrypt");
+- python: everything else.
+Each response carries the split in a Server-Timing header, so it shows up
+in the browser's network panel. Each (endpoint, component) pair also feeds
+a histogram that /metrics serves in the Prometheus text format. Histograms
+are kept per worker process; scrape each worker, or sum them in Prometheus.
+
+An admin can add ?_profile=1 to any GET to get a profile of that request
+in place of the page. pyinstrument's sampling profiler is used when it's
+installed, otherwise cProfile.
+
+PROFILING=0 turns all of this off. /metrics requires
+"Authorization: Bearer <METRICS_TOKEN>", and answers 404 while
+METRICS_TOKEN isn't set.
+"""
+import bisect
+import hmac
+import io
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import Response, abort, before_render_template, current_app, g, request, template_rendered
+from pymongo import monitoring
+
+try:
+    import pyinstrument  # optional; cProfile is used when it isn't installed
+    HAVE_PYINSTRUMENT = True
+except ImportError:
+    pyinstrument = None
+    HAVE_PYINSTRUMENT = False
+
+DEFAULTS = {
+    "PROFILING": os.environ.get("PROFILING", "1") != "0",
+    "METRICS_TOKEN": os.environ.get("METRICS_TOKEN"),
+    "PROFILE_QUERY_ARG": "_profile",
+}
+COMPONENTS = ("db", "template", "bcrypt", "python")
+# Histogram upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The span record of the request running on this thread, if any. Pymongo
+# invokes listeners on the thread that ran the command.
+_local = threading.local()
+_listener_registered = False
+
+def init_app(app):
+    """
+    Must run before database.init_app(): pymongo only applies globally
+    registered listeners to clients created afterwards.
+    """
+    global _listener_registered
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    if not app.config["PROFILING"]:
+        return
+    if not _listener_registered:
+        monitoring.register(_CommandTimer())
+        _listener_registered = True
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    app.add_url_rule("/metrics", "metrics", metrics)
+
+# -------- Spans --------
+def _current():
+    return getattr(_local, "spans", None)
+
+def _add(component, seconds):
+    spans = _current()
+    if spans is not None:
+        spans[component] = spans.get(component, 0.0) + seconds
+
+@contextmanager
+def span(component):
+    """Adds the time spent in the block to `component` for the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add(component, time.perf_counter() - start)
+
+class _CommandTimer(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        _add("db", event.duration_micros / 1e6)
+
+    def failed(self, event):
+        _add("db", event.duration_micros / 1e6)
+
+def _template_started(sender, template, context, **extra):
+    if _current() is not None:
+        _local.template_starts.append(time.perf_counter())
+
+def _template_finished(sender, template, context, **extra):
+    starts = getattr(_local, "template_starts", None)
+    if starts:
+        _add("template", time.perf_counter() - starts.pop())
+
+# -------- Request hooks --------
+def _before_request():
+    _local.spans = {}
+    _local.template_starts = []
+    g._profile_start = time.perf_counter()
+    if request.method == "GET" and request.args.get(current_app.config["PROFILE_QUERY_ARG"]) == "1":
+        if _is_admin():
+            g._profiler = _start_profiler()
+
+def _after_request(response):
+    spans = _current()
+    start = g.pop("_profile_start", None)
+    if spans is None or start is None:
+        return response
+    total = time.perf_counter() - start
+    spans["python"] = max(total - sum(spans.get(c, 0.0) for c in COMPONENTS if c != "python"), 0.0)
+
+    response.headers["Server-Timing"] = ", ".join(
+        [f"{c};dur={spans.get(c, 0.0) * 1000:.1f}" for c in COMPONENTS]
+        + [f"total;dur={total * 1000:.1f}"])
+    if request.endpoint not in (None, "metrics", "static"):
+        _record(request.endpoint, total, spans)
+
+    profiler = g.pop("_profiler", None)
+    if profiler is not None:
+        return _profile_response(profiler)
+    return response
+
+def _teardown_request(exc):
+    _local.spans = None
+    _local.template_starts = []
+    profiler = g.pop("_profiler", None)
+    if profiler is not None:
+        _stop_profiler(profiler)  # the view raised before after_request ran
+
+def _is_admin():
+    from flask_login import current_user
+    return current_user.is_authenticated and getattr(current_user, "role", None) == "admin"
+
+# -------- Profiler --------
+def _start_profiler():
+    if HAVE_PYINSTRUMENT:
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    return profiler
+
+def _stop_profiler(profiler):
+    if HAVE_PYINSTRUMENT:
+        profiler.stop()
+    else:
+        profiler.disable()
+
+def _profile_response(profiler):
+    _stop_profiler(profiler)
+    if HAVE_PYINSTRUMENT:
+        return Response(profiler.output_html(), mimetype="text/html")
+    import pstats
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(60)
+    return Response(out.getvalue(), mimetype="text/plain")
+
+# -------- Histograms --------
+class _Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(BUCKETS, value)
+        if i < len(BUCKETS):
+            self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+_histograms = {}  # (metric, endpoint, component) -> _Histogram
+_histograms_lock = threading.Lock()
+
+def _record(endpoint, total, spans):
+    with _histograms_lock:
+        for key, value in [(("request", endpoint, None), total)] + [
+                (("component", endpoint, c), spans.get(c, 0.0)) for c in COMPONENTS]:
+            hist = _histograms.get(key)
+            if hist is None:
+                hist = _histograms[key] = _Histogram()
+            hist.observe(value)
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render_metrics():
+    """Current histograms in the Prometheus text exposition format."""
+    names = {
+        "request": ("http_request_duration_seconds", "Request wall time by endpoint."),
+        "component": ("http_request_component_seconds",
+                      "Request wall time by endpoint and component (db, template, bcrypt, python)."),
+    }
+    with _histograms_lock:
+        snapshot = {k: (list(h.counts), h.total, h.count) for k, h in _histograms.items()}
+
+    lines = []
+    for metric, (name, help_text) in names.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for (kind, endpoint, component), (counts, total, count) in sorted(
+                snapshot.items(), key=lambda kv: (kv[0][1], kv[0][2] or "")):
+            if kind != metric:
+                continue
+            labels = f'endpoint="{_label_value(endpoint)}"'
+            if component:
+                labels += f',component="{component}"'
+            cumulative = 0
+            for bound, n in zip(BUCKETS, counts):
+                cumulative += n
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{name}_sum{{{labels}}} {total:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {count}")
+    return "\n".join(lines) + "\n"
+
+def metrics():
+    token = current_app.config["METRICS_TOKEN"]
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get("Authorization", "").encode(), f"Bearer {token}".encode()):
+        abort(401)
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,241 @@
+"""
+Practice-question generation for assignment templates.
+
+A request for N questions is split into prompts of up to
+QUESTIONS_PER_PROMPT questions. The prompts are looked up in the
+`generated_questions_cache` collection by normalized-prompt hash (one $in
+query). Only misses go to the model, concurrently on a bounded pool. The
+whole job runs on the background pool (see background.py), so a slow model
+never holds a gunicorn worker; the browser polls the job document instead.
+Model calls time out after QUESTION_GEN_TIMEOUT seconds, and a job that
+hasn't finished JOB_DEADLINE after it was created is marked failed, so a
+hung model can't hold the shared pool or leave a job "running" forever.
+
+Backends:
+- "gemini": Google Generative AI (google-generativeai, imported lazily).
+- "stub": deterministic local questions for tests and offline runs.
+QUESTION_GEN_BACKEND picks one. The default is gemini when GEMINI_API_KEY
+is set, otherwise stub.
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime, timedelta
+from bson import ObjectId
+import background
+from database import get_db
+
+log = logging.getLogger(__name__)
+
+QUESTION_TYPES = ("single_response", "multiple_choice")
+MAX_QUESTIONS_PER_JOB = 50
+QUESTIONS_PER_PROMPT = 5
+# Upper bound on concurrent model calls per worker process.
+GEN_CONCURRENCY = int(os.environ.get("QUESTION_GEN_CONCURRENCY", "4"))
+# Seconds one model call may take.
+GEN_TIMEOUT = float(os.environ.get("QUESTION_GEN_TIMEOUT", "60"))
+# A job not finished this long after it was created counts as failed.
+JOB_DEADLINE = timedelta(seconds=float(os.environ.get("QUESTION_GEN_JOB_DEADLINE", "300")))
+TIMEOUT_ERROR = "The question generator took too long; please try again."
+
+_model_pool = None
+
+# -------- Backends --------
+class StubBackend:
+    """Deterministic arithmetic questions; output depends only on the prompt."""
+    name = "stub"
+
+    def generate(self, prompt, count, q_type):
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+        questions = []
+        for _ in range(count):
+            a, b = rng.randint(2, 20), rng.randint(2, 20)
+            answer = a * b
+            text = f"What is ${a} \\times {b}$?"
+            if q_type == "multiple_choice":
+                options = sorted({answer, answer + a, answer - b, answer + 1})
+                questions.append({"text": text, "type": q_type,
+                                  "options": [str(o) for o in options],
+                                  "answer": options.index(answer)})
+            else:
+                questions.append({"text": text, "type": q_type, "answer": str(answer)})
+        return questions
+
+
+class GeminiBackend:
+    """Google Generative AI. The SDK is only imported when first used."""
+    name = "gemini"
+
+    def __init__(self, api_key, model_name):
+        self.api_key = api_key
+        self.model_name = model_name
+        self._model = None
+
+    def _get_model(self):
+        if self._model is None:
+            import google.generativeai as genai  # heavy import, deferred until needed
+            genai.configure(api_key=self.api_key)
+            self._model = genai.GenerativeModel(
+                self.model_name,
+                generation_config={"response_mime_type": "application/json"},
+            )
+        return self._model
+
+    def generate(self, prompt, count, q_type):
+        response = self._get_model().generate_content(prompt, request_options={"timeout": GEN_TIMEOUT})
+        return json.loads(response.text)
+
+
+def get_backend():
+    choice = os.environ.get("QUESTION_GEN_BACKEND")
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if choice is None:
+        choice = "gemini" if api_key else "stub"
+    if choice == "gemini":
+        if not api_key:
+            raise RuntimeError("GEMINI_API_KEY not set. Please check your .env file.")
+        return GeminiBackend(api_key, os.environ.get("GEMINI_MODEL", "gemini-1.5-flash"))
+    return StubBackend()
+
+# -------- Prompts & cache --------
+def normalize_prompt(prompt):
+    return re.sub(r"\s+", " ", prompt).strip().lower()
+
+def prompt_hash(backend, prompt):
+    model = getattr(backend, "model_name", "")
+    key = f"{backend.name}:{model}:{normalize_prompt(prompt)}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def build_prompts(topic, count, q_type):
+    """Splits a request into (prompt, count) pairs of at most QUESTIONS_PER_PROMPT questions."""
+    shape = ('{"text": str, "type": "multiple_choice", "options": [str, ...], "answer": <index of correct option>}'
+             if q_type == "multiple_choice" else
+             '{"text": str, "type": "single_response", "answer": str}')
+    prompts = []
+    for batch_no, start in enumerate(range(0, count, QUESTIONS_PER_PROMPT)):
+        n = min(QUESTIONS_PER_PROMPT, count - start)
+        prompts.append((
+            f"Write {n} distinct practice math questions about: {topic}. "
+            f"Use $...$ for inline math. Set {batch_no + 1}. "
+            f"Respond with a JSON array of objects shaped like {shape}.",
+            n,
+        ))
+    return prompts
+
+def clean_question(q, q_type):
+    """Validates one generated question; returns None if it can't be used."""
+    if not isinstance(q, dict) or not str(q.get("text", "")).strip():
+        return None
+    cleaned = {"text": str(q["text"]).strip(), "type": q_type}
+    if q_type == "multiple_choice":
+        options = [str(o).strip() for o in q.get("options") or [] if str(o).strip()]
+        try:
+            answer = int(q.get("answer"))
+        except (TypeError, ValueError):
+            return None
+        if len(options) < 2 or not 0 <= answer < len(options):
+            return None
+        cleaned.update(options=options, answer=answer)
+    else:
+        answer = str(q.get("answer", "")).strip()
+        if not answer:
+            return None
+        cleaned["answer"] = answer
+    return cleaned
+
+def _get_model_pool():
+    global _model_pool
+    if _model_pool is None:
+        _model_pool = ThreadPoolExecutor(max_workers=GEN_CONCURRENCY, thread_name_prefix="question-gen")
+    return _model_pool
+
+def generate_questions(topic, count, q_type, backend=None, deadline=None):
+    """
+    Generates `count` questions, serving repeated prompts from the cache
+    and running the rest concurrently (at most GEN_CONCURRENCY at a time).
+    Only prompts that produced all their questions are cached. With a
+    `deadline` (time.monotonic() value), raises TimeoutError once it
+    passes while waiting for the model.
+    """
+    backend = backend or get_backend()
+    db = get_db()
+    prompts = build_prompts(topic, count, q_type)
+    hashes = [prompt_hash(backend, p) for p, _ in prompts]
+
+    cached = {d["_id"]: d["questions"]
+              for d in db.generated_questions_cache.find({"_id": {"$in": hashes}})}
+    misses = [(h, p, n) for h, (p, n) in zip(hashes, prompts) if h not in cached]
+
+    futures = {h: (n, _get_model_pool().submit(backend.generate, p, n, q_type)) for h, p, n in misses}
+    for h, (n, future) in futures.items():
+        try:
+            raw = future.result(timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+        except FutureTimeout:
+            raise TimeoutError(TIMEOUT_ERROR) from None
+        if not isinstance(raw, list):
+            raw = []  # e.g. the model returned a JSON object instead of an array
+        questions = [q for q in (clean_question(q, q_type) for q in raw) if q]
+        cached[h] = questions
+        if len(questions) != n:
+            # Partial or unusable output isn't cached, so the next request retries the model.
+            log.warning("Prompt %s gave %d of %d usable questions; not caching", h[:12], len(questions), n)
+            continue
+        db.generated_questions_cache.update_one(
+            {"_id": h},
+            {"$set": {"questions": questions, "backend": backend.name,
+                      "created_at": datetime.utcnow()}},
+            upsert=True,
+        )
+
+    return [q for h in hashes for q in cached[h]][:count]
+
+# -------- Jobs --------
+def start_job(teacher_id, topic, count, q_type):
+    """Records a generation job and runs it in the background. Returns the job id."""
+    job_id = get_db().question_gen_jobs.insert_one({
+        "created_by": ObjectId(teacher_id),
+        "topic": topic,
+        "count": count,
+        "type": q_type,
+        "status": "pending",
+        "created_at": datetime.utcnow(),
+    }).inserted_id
+    background.submit(run_job, job_id)
+    return job_id
+
+def run_job(job_id):
+    db = get_db()
+    job = db.question_gen_jobs.find_one_and_update(
+        {"_id": job_id, "status": "pending"}, {"$set": {"status": "running"}})
+    if not job:
+        return
+    remaining = job["created_at"] + JOB_DEADLINE - datetime.utcnow()
+    # A job that already timed out (see expire_job) keeps its error status.
+    running = {"_id": job_id, "status": "running"}
+    try:
+        questions = generate_questions(job["topic"], job["count"], job["type"],
+                                       deadline=time.monotonic() + remaining.total_seconds())
+    except Exception as e:
+        log.exception("Question generation job %s failed", job_id)
+        db.question_gen_jobs.update_one(running, {"$set": {
+            "status": "error", "error": str(e), "finished_at": datetime.utcnow()}})
+        return
+    db.question_gen_jobs.update_one(running, {"$set": {
+        "status": "done", "questions": questions, "finished_at": datetime.utcnow()}})
+
+def expire_job(job):
+    """
+    Marks a job that is still pending or running past JOB_DEADLINE as
+    failed (e.g. its worker died or is stuck). Returns the job as it now is.
+    """
+    if job["status"] not in ("pending", "running") or datetime.utcnow() < job["created_at"] + JOB_DEADLINE:
+        return job
+    get_db().question_gen_jobs.update_one(
+        {"_id": job["_id"], "status": {"$in": ["pending", "running"]}},
+        {"$set": {"status": "error", "error": TIMEOUT_ERROR, "finished_at": datetime.utcnow()}})
+    return get_db().question_gen_jobs.find_one({"_id": job["_id"]})
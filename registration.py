@@ -0,0 +1,215 @@
+"""
+Capacity-limited class registration with a waitlist.
+
+A class may have a `capacity` (None means unlimited) and keeps a
+`seats_taken` counter. A seat is claimed with a single find_one_and_update
+that increments `seats_taken` only while it is below `capacity`. Concurrent
+registrations can't overbook, because MongoDB applies each update to the
+document atomically.
+
+A student who doesn't get a seat is waitlisted. When a registered student
+drops, or a teacher raises the capacity, the oldest waitlisted students
+are promoted into the freed seats.
+
+Registration statuses: "registered", "waitlisted" and "dropped". A
+unique (center_id, student_id, class_id) index keeps one registration per
+student and class. Re-registering after a drop reuses that document.
+
+seats_taken changes on every registration, so it doesn't invalidate the
+class caches (which would thrash them while a class is filling up). Only
+a class becoming full or reopening does; cached seat counts may otherwise
+lag, but the guard on the write is what decides.
+"""
+from datetime import datetime
+import click
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import get_db, tenant_db, DEFAULT_CENTER_ID
+from cache_bus import notify
+
+REGISTERED = "registered"
+WAITLISTED = "waitlisted"
+DROPPED = "dropped"
+# Registrations that count as being in the class (documents from before
+# statuses existed have none).
+ACTIVE_FILTER = {"status": {"$nin": [WAITLISTED, DROPPED]}}
+
+# -------- Seats --------
+def _has_seat_filter(class_id):
+    return {"_id": class_id, "$or": [
+        {"capacity": None},
+        {"$expr": {"$lt": [{"$ifNull": ["$seats_taken", 0]}, "$capacity"]}},
+    ]}
+
+def _overbooked_filter(class_id):
+    # More seats taken than the capacity allows: the capacity was lowered
+    # below the number of registered students.
+    return {"_id": class_id, "capacity": {"$ne": None},
+            "$expr": {"$gt": [{"$ifNull": ["$seats_taken", 0]}, "$capacity"]}}
+
+def claim_seat(db, class_id):
+    """Takes one seat if the class has room. Returns the updated class, or None if it's full."""
+    class_obj = db.classes.find_one_and_update(
+        _has_seat_filter(class_id), {"$inc": {"seats_taken": 1}},
+        return_document=ReturnDocument.AFTER)
+    if class_obj and seats_left(class_obj) == 0:
+        notify("classes")  # just filled up
+    return class_obj
+
+def release_seat(db, class_id):
+    class_obj = db.classes.find_one_and_update(
+        {"_id": class_id, "seats_taken": {"$gt": 0}}, {"$inc": {"seats_taken": -1}},
+        return_document=ReturnDocument.AFTER)
+    if class_obj and seats_left(class_obj) == 1:
+        notify("classes")  # just reopened
+
+def give_up_seat(db, class_id):
+    """
+    Releases a claimed seat, then fills it from the waitlist: a student
+    may have been waitlisted while the seat was held, and must not lose
+    it to the next new registration.
+    """
+    release_seat(db, class_id)
+    promote_waitlist(class_id)
+
+def release_excess_seat(db, class_id):
+    """Releases one seat if the class is overbooked. Returns True if it did."""
+    return db.classes.find_one_and_update(
+        _overbooked_filter(class_id), {"$inc": {"seats_taken": -1}}) is not None
+
+def seats_left(class_obj):
+    """Seats still open, or None for unlimited classes."""
+    if class_obj.get("capacity") is None:
+        return None
+    return max(class_obj["capacity"] - class_obj.get("seats_taken", 0), 0)
+
+def recount_seats(db, class_id):
+    """
+    Resets seats_taken from the registrations (repairs seats leaked by a
+    crash mid-registration). `db` is a tenant_db(). Registrations made
+    while it runs can make the count stale; run it when the class is quiet.
+    """
+    taken = db.class_registrations.count_documents({"class_id": class_id, **ACTIVE_FILTER})
+    db.classes.update_one({"_id": class_id}, {"$set": {"seats_taken": taken}})
+    return taken
+
+# -------- Registering & dropping --------
+def register(class_obj, student_id, details):
+    """
+    Registers a student for a class, or waitlists them when it is full.
+    `details` holds the contact fields stored on the registration. Returns
+    the resulting status, or None if the student already holds a
+    registration or waitlist spot.
+    """
+    db = tenant_db()
+    class_id = class_obj["_id"]
+    key = {"student_id": student_id, "class_id": class_id}
+    existing = db.class_registrations.find_one(key, {"status": 1})
+    if existing and existing.get("status") != DROPPED:
+        return None
+
+    now = datetime.utcnow()
+    status = REGISTERED if claim_seat(db, class_id) else WAITLISTED
+    fields = dict(details, class_name=class_obj["name"], status=status, registration_date=now)
+    if status == WAITLISTED:
+        fields["waitlisted_at"] = now
+
+    try:
+        if existing:
+            # Re-registering after a drop; only one request may revive the document.
+            done = db.class_registrations.find_one_and_update(
+                dict(key, status=DROPPED), {"$set": fields, "$unset": {"dropped_at": ""}})
+        else:
+            done = db.class_registrations.insert_one(dict(key, **fields))
+    except DuplicateKeyError:
+        done = None  # a concurrent request registered the same student first
+    if not done:
+        if status == REGISTERED:
+            give_up_seat(db, class_id)
+        return None
+    if status == WAITLISTED and promote_waitlist(class_id):
+        # A seat freed up while this student was being waitlisted.
+        status = db.class_registrations.find_one(key, {"status": 1})["status"]
+    return status
+
+def drop(class_id, student_id):
+    """
+    Drops a student's registration or waitlist spot. A freed seat passes
+    straight to the oldest waitlisted student, so a new registration can't
+    jump the queue, unless the class is over a lowered capacity: then the
+    seat is given up instead. Returns the status the student had, or None.
+    """
+    db = tenant_db()
+    reg = db.class_registrations.find_one_and_update(
+        {"student_id": student_id, "class_id": class_id, "status": {"$ne": DROPPED}},
+        {"$set": {"status": DROPPED, "dropped_at": datetime.utcnow()}})
+    if not reg:
+        return None
+    previous = reg.get("status", REGISTERED)
+    if previous == WAITLISTED or release_excess_seat(db, class_id):
+        return previous
+    if not _promote_next(db, class_id):
+        give_up_seat(db, class_id)
+    return previous
+
+def _promote_next(db, class_id):
+    """
+    Gives an already-claimed seat to the oldest waitlisted student. Returns
+    False if nobody is waiting. The oldest is looked up first and then
+    updated by the full shard key (center_id, student_id), so the write
+    goes to one shard; if that student was promoted or dropped in between,
+    the next one is tried.
+    """
+    while True:
+        nxt = db.class_registrations.find_one(
+            {"class_id": class_id, "status": WAITLISTED}, {"student_id": 1},
+            sort=[("waitlisted_at", 1), ("_id", 1)])
+        if nxt is None:
+            return False
+        promoted = db.class_registrations.update_one(
+            {"student_id": nxt["student_id"], "class_id": class_id, "_id": nxt["_id"], "status": WAITLISTED},
+            {"$set": {"status": REGISTERED, "promoted_at": datetime.utcnow()}})
+        if promoted.modified_count:
+            return True
+
+def promote_waitlist(class_id):
+    """
+    Fills open seats from the waitlist, oldest first (e.g. after the
+    capacity is raised). Each promotion claims a seat before taking a
+    student off the waitlist, so this is safe to run concurrently with
+    registrations. Returns the number promoted.
+    """
+    db = tenant_db()
+    promoted = 0
+    while claim_seat(db, class_id):
+        if not _promote_next(db, class_id):
+            release_seat(db, class_id)
+            break
+        promoted += 1
+    return promoted
+
+# -------- CLI --------
+def register_commands(app):
+    """Adds `flask recount-seats` to the app's CLI."""
+
+    @app.cli.command("recount-seats")
+    @click.option("--center", "center_id", default=None, help="Only this center's classes.")
+    @click.option("--class-id", default=None, help="Only this class.")
+    def recount_seats_command(center_id, class_id):
+        """Recount classes' seats_taken from their registrations."""
+        query = {}
+        if center_id:
+            query["center_id"] = center_id
+        if class_id:
+            query["_id"] = ObjectId(class_id)
+        fixed = total = 0
+        for c in get_db().classes.find(query, {"center_id": 1, "seats_taken": 1}):
+            taken = recount_seats(tenant_db(c.get("center_id") or DEFAULT_CENTER_ID), c["_id"])
+            total += 1
+            if taken != c.get("seats_taken"):
+                fixed += 1
+                click.echo(f"{c['_id']}: seats_taken {c.get('seats_taken')} -> {taken}")
+        if fixed:
+            notify("classes")
+        click.echo(f"Recounted {total} classes, {fixed} corrected.")
@@ -0,0 +1,106 @@
+import calendar
+from datetime import datetime, timedelta
+from bson import ObjectId
+from database import tenant_db
+from cache_bus import cached
+
+# Month views are cached per (year, month, teacher) for at most this many seconds.
+SCHEDULE_CACHE_TTL = 300
+
+def month_bounds(year, month):
+    """Returns [start, end) datetimes covering the given month."""
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return start, end
+
+def month_classes(year, month, teacher_id=None):
+    """
+    Returns classes running at any time in the month (starting, ending or
+    spanning it), as plain dicts.
+    With a teacher_id, only that teacher's classes are returned; otherwise
+    only active classes.
+    """
+    return _month_classes(year, month, str(teacher_id) if teacher_id else None)
+
+@cached("classes", ttl=SCHEDULE_CACHE_TTL)
+def _month_classes(year, month, teacher_id):
+    # One range query per (year, month, teacher), cached until classes change.
+    start, end = month_bounds(year, month)
+    # Overlap with [start, end); a class without an end date lasts one day.
+    filt = {"start_date": {"$lt": end}, "$or": [
+        {"end_date": {"$gte": start}},
+        {"end_date": None, "start_date": {"$gte": start}},
+    ]}
+    if teacher_id:
+        filt["created_by"] = ObjectId(teacher_id)
+    else:
+        filt["is_active"] = True
+
+    classes = [
+        {
+            "id": str(c["_id"]),
+            "name": c.get("name", ""),
+            "start_date": c.get("start_date"),
+            "end_date": c.get("end_date"),
+        }
+        for c in tenant_db().classes.find(
+            filt, {"name": 1, "start_date": 1, "end_date": 1}
+        ).sort("start_date", 1)
+    ]
+    return classes
+
+def month_view(year, month, teacher_id=None):
+    """
+    Builds the context expected by templates/schedule.html:
+    calendar (weeks of day numbers, 0 for padding), events (day -> labels),
+    month_name and year.
+    """
+    events = {day: [] for day in range(1, calendar.monthrange(year, month)[1] + 1)}
+    for c in month_classes(year, month, teacher_id):
+        labelled = False
+        for label, when in (("Starts", c["start_date"]), ("Ends", c["end_date"])):
+            if isinstance(when, datetime) and (when.year, when.month) == (year, month):
+                events[when.day].append(f"{label}: {c['name']}")
+                labelled = True
+        if not labelled:
+            # Started before this month and ends after it
+            events[1].append(f"Continues: {c['name']}")
+    return {
+        "calendar": calendar.monthcalendar(year, month),
+        "events": events,
+        "month_name": calendar.month_name[month],
+        "year": year,
+    }
+
+def _ics_escape(text):
+    return (text.replace("\\", "\\\\").replace(";", "\\;")
+                .replace(",", "\\,").replace("\n", "\\n"))
+
+def month_ics(year, month, teacher_id=None, host="learningcenter"):
+    """
+    Renders the same cached month data as an iCalendar feed, one all-day
+    VEVENT per class spanning its start and end dates.
+    """
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//EdHelper LLC//Class Schedule//EN",
+        "CALSCALE:GREGORIAN",
+    ]
+    for c in month_classes(year, month, teacher_id):
+        if not isinstance(c["start_date"], datetime):
+            continue
+        last_day = c["end_date"] if isinstance(c["end_date"], datetime) else c["start_date"]
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{c['id']}@{host}",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART;VALUE=DATE:{c['start_date']:%Y%m%d}",
+            # DTEND is exclusive for all-day events
+            f"DTEND;VALUE=DATE:{last_day + timedelta(days=1):%Y%m%d}",
+            f"SUMMARY:{_ics_escape(c['name'])}",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(lines) + "\r\n"
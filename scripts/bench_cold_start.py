@@ -0,0 +1,77 @@
+"""
+Cold-start benchmark: measures, in fresh interpreters, how long it takes to
+import the app module, build the app with create_app(), and serve the
+first request (GET /login, which doesn't touch MongoDB).
+
+    python scripts/bench_cold_start.py --runs 10
+    python scripts/bench_cold_start.py --importtime   # top imports by cumulative time
+
+Without --preload gunicorn pays this per worker. With --preload only the
+master does.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+import app as app_module
+t1 = time.perf_counter()
+app = app_module.create_app()
+t2 = time.perf_counter()
+resp = app.test_client().get('/login')
+t3 = time.perf_counter()
+assert resp.status_code == 200, resp.status_code
+print(json.dumps({"import": t1 - t0, "create_app": t2 - t1, "first_request": t3 - t2, "total": t3 - t0}))
+"""
+
+def probe_env():
+    env = dict(os.environ)
+    # Connecting is lazy, so a placeholder URI is enough for this benchmark.
+    env.setdefault("MONGO_URI", "mongodb://localhost:27017/cold_start_bench")
+    env.setdefault("SECRET_KEY", "cold-start-bench")
+    return env
+
+def run_once():
+    out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=probe_env(),
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def importtime(top):
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                         cwd=ROOT, env=probe_env(), capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # "import time:  self_us | cumulative_us | package"
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), name))
+    for cumulative_us, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:9.1f} ms  {name.strip()}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", action="store_true", help="show the slowest imports instead")
+    parser.add_argument("--top", type=int, default=25)
+    args = parser.parse_args()
+
+    if args.importtime:
+        importtime(args.top)
+        return
+
+    results = [run_once() for _ in range(args.runs)]
+    print(f"{'phase':<15}{'median ms':>12}{'min ms':>10}{'max ms':>10}")
+    for phase in ("import", "create_app", "first_request", "total"):
+        values = [r[phase] * 1000 for r in results]
+        print(f"{phase:<15}{statistics.median(values):>12.1f}{min(values):>10.1f}{max(values):>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Export throughput benchmark: feeds synthetic submission-like rows through
+each export writer and reports rows/second and peak Python memory.
+
+    python scripts/bench_exports.py --rows 100000
+    python scripts/bench_exports.py --rows 1000000 --formats parquet arrow
+
+No MongoDB is needed; this measures the writers that the Mongo-backed
+datasets in exports.py stream into. Needs XlsxWriter and pyarrow.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import exports  # noqa: E402
+
+COLUMNS = exports.SUBMISSION_COLUMNS
+
+def synthetic_rows(n):
+    start = datetime(2025, 9, 1)
+    for i in range(n):
+        yield (f"{i % 500:024x}", f"Assignment {i % 500}", f"{i:024x}",
+               start + timedelta(seconds=i), i % 11, 10)
+
+def bench(fmt, rows, folder):
+    path = os.path.join(folder, f"bench.{fmt}")
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    exports.WRITERS[fmt](COLUMNS, synthetic_rows(rows), path)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, os.path.getsize(path)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--formats", nargs="+", default=list(exports.EXPORT_FORMATS),
+                        choices=exports.EXPORT_FORMATS)
+    args = parser.parse_args()
+
+    print(f"{args.rows} rows")
+    print(f"{'format':<10}{'seconds':>10}{'rows/s':>12}{'peak MiB':>10}{'file MiB':>10}")
+    with tempfile.TemporaryDirectory() as folder:
+        for fmt in args.formats:
+            elapsed, peak, size = bench(fmt, args.rows, folder)
+            print(f"{fmt:<10}{elapsed:>10.2f}{args.rows / elapsed:>12,.0f}"
+                  f"{peak / 2**20:>10.1f}{size / 2**20:>10.1f}")
+
+if __name__ == "__main__":
+    main()
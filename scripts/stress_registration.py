@@ -0,0 +1,176 @@
+"""
+Registration concurrency test: many students register for one
+capacity-limited class at the same instant, then some of them drop.
+Checks that the class is never overbooked, that seats_taken matches the
+registrations, and that drops are filled from the waitlist. Finally the
+capacity is lowered below the registrations and more students drop: those
+seats must be given up until the class is back within capacity, and only
+then refilled from the waitlist. Last, on a second class, students drop
+while others register (some twice) at the same moment: a freed seat must
+never be left open next to a waitlisted student.
+
+    MONGO_URI=mongodb://localhost:27017/stress SECRET_KEY=x \
+        python scripts/stress_registration.py --students 300 --capacity 25 --threads 64
+
+Needs a real (disposable) MongoDB: indexes are created on it, and the
+test data goes into its own center, which is removed afterwards unless
+--keep is given. Requests go through the app's test client, so the full
+register_class/drop_class views run, from many threads at once.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import create_app  # noqa: E402
+from database import get_db, init_indexes, TENANT_COLLECTIONS  # noqa: E402
+
+def hammer(app, student_ids, make_request, threads):
+    """
+    Runs make_request(client, student_id) for every student on `threads`
+    threads. The first wave is held back and released at once.
+    """
+    start = threading.Event()
+
+    def one(student_id):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(student_id)
+            session["_fresh"] = True
+        start.wait()
+        return make_request(client, student_id).status_code
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = pool.map(one, student_ids)
+        time.sleep(0.5)  # let the first wave log in and line up
+        start.set()
+        return Counter(results)
+
+def register(client, class_id):
+    return client.post("/register_class", data={"student_name": "Stress", "contact_email": "s@example.com",
+                                                 "class_id": str(class_id)})
+
+def check(db, center_id, class_id, capacity, expect_registered, expect_waitlisted, overbooked_ok=False):
+    regs = list(db.class_registrations.find({"center_id": center_id, "class_id": class_id}))
+    statuses = Counter(r.get("status") for r in regs)
+    per_student = Counter(r["student_id"] for r in regs)
+    seats_taken = db.classes.find_one({"_id": class_id})["seats_taken"]
+    problems = []
+    if statuses["registered"] > capacity and not overbooked_ok:
+        problems.append(f"overbooked: {statuses['registered']} registered, capacity {capacity}")
+    if seats_taken != statuses["registered"]:
+        problems.append(f"seats_taken is {seats_taken} but {statuses['registered']} are registered")
+    if statuses["registered"] != expect_registered:
+        problems.append(f"expected {expect_registered} registered, found {statuses['registered']}")
+    if capacity is not None and statuses["registered"] < capacity and statuses["waitlisted"]:
+        problems.append(f"{statuses['waitlisted']} waitlisted while {capacity - statuses['registered']} seats are free")
+    if statuses["waitlisted"] != expect_waitlisted:
+        problems.append(f"expected {expect_waitlisted} waitlisted, found {statuses['waitlisted']}")
+    duplicates = [s for s, n in per_student.items() if n > 1]
+    if duplicates:
+        problems.append(f"{len(duplicates)} students have more than one registration")
+    print(f"  statuses {dict(statuses)}, seats_taken {seats_taken}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--capacity", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=50)
+    parser.add_argument("--repeats", type=int, default=2,
+                        help="Concurrent registration requests per student (double submits).")
+    parser.add_argument("--drops", type=int, default=10, help="Registered students who then drop, concurrently.")
+    parser.add_argument("--keep", action="store_true", help="Leave the test data in the database.")
+    args = parser.parse_args()
+
+    app = create_app()
+    center_id = f"stress-{uuid.uuid4().hex[:8]}"
+    problems = []
+    with app.app_context():
+        db = get_db()
+        init_indexes()
+        teacher_id = db.users.insert_one({"name": "Stress Teacher", "email": f"teacher@{center_id}.test",
+                                          "role": "teacher", "center_id": center_id}).inserted_id
+        class_id = db.classes.insert_one({"name": "Stress Class", "capacity": args.capacity, "seats_taken": 0,
+                                          "is_active": True, "created_by": teacher_id,
+                                          "center_id": center_id}).inserted_id
+        student_ids = db.users.insert_many([
+            {"name": f"Student {i}", "email": f"student{i}@{center_id}.test", "role": "student",
+             "center_id": center_id}
+            for i in range(args.students)]).inserted_ids
+        try:
+            print(f"{args.students} students x {args.repeats} requests -> capacity {args.capacity}, "
+                  f"{args.threads} threads (center {center_id})")
+            t0 = time.perf_counter()
+            codes = hammer(app, student_ids * args.repeats,
+                           lambda client, sid: register(client, class_id), args.threads)
+            elapsed = time.perf_counter() - t0
+            print(f"  {sum(codes.values())} requests in {elapsed:.2f}s ({sum(codes.values()) / elapsed:.0f}/s), "
+                  f"status codes {dict(codes)}")
+            registered = min(args.capacity, args.students)
+            problems += check(db, center_id, class_id, args.capacity, registered, args.students - registered)
+
+            dropping = [r["student_id"] for r in db.class_registrations.find(
+                {"center_id": center_id, "class_id": class_id, "status": "registered"}).limit(args.drops)]
+            print(f"{len(dropping)} registered students drop at once")
+            hammer(app, dropping, lambda client, sid: client.post(f"/drop_class/{class_id}"), args.threads)
+            waitlisted = max(args.students - registered - len(dropping), 0)
+            problems += check(db, center_id, class_id, args.capacity,
+                              min(args.capacity, args.students - len(dropping)), waitlisted)
+            promoted = [r["waitlisted_at"] for r in db.class_registrations.find(
+                {"center_id": center_id, "class_id": class_id, "promoted_at": {"$exists": True}})]
+            waiting = [r["waitlisted_at"] for r in db.class_registrations.find(
+                {"center_id": center_id, "class_id": class_id, "status": "waitlisted"})]
+            if promoted and waiting and max(promoted) > min(waiting):
+                problems.append("a later waitlisted student was promoted ahead of an earlier one")
+
+            # Lower the capacity below the registrations (as edit_class may),
+            # then drop more students than the excess: the first drops only
+            # give up seats, the rest are refilled from the waitlist.
+            registered = db.class_registrations.count_documents(
+                {"center_id": center_id, "class_id": class_id, "status": "registered"})
+            lowered = max(registered - max(args.drops // 2, 1), 0)
+            db.classes.update_one({"_id": class_id}, {"$set": {"capacity": lowered}})
+            dropping = [r["student_id"] for r in db.class_registrations.find(
+                {"center_id": center_id, "class_id": class_id, "status": "registered"}).limit(args.drops)]
+            print(f"capacity lowered to {lowered}; {len(dropping)} registered students drop at once")
+            hammer(app, dropping, lambda client, sid: client.post(f"/drop_class/{class_id}"), args.threads)
+            remaining = registered - len(dropping)
+            expect = max(remaining, min(lowered, remaining + waitlisted))
+            problems += check(db, center_id, class_id, lowered, expect, waitlisted - (expect - remaining),
+                              overbooked_ok=remaining > lowered)
+
+            race_class_id = db.classes.insert_one({"name": "Stress Race Class", "capacity": args.capacity,
+                                                   "seats_taken": 0, "is_active": True, "created_by": teacher_id,
+                                                   "center_id": center_id}).inserted_id
+            holders = student_ids[:args.capacity]
+            newcomers = student_ids[args.capacity:args.capacity * 3]
+            hammer(app, holders, lambda client, sid: register(client, race_class_id), args.threads)
+            print(f"{len(holders)} students drop while {len(newcomers)} register "
+                  f"({args.repeats} requests each) on a second class")
+            leaving = set(holders)
+            hammer(app, holders + newcomers * args.repeats, lambda client, sid: (
+                client.post(f"/drop_class/{race_class_id}") if sid in leaving
+                else register(client, race_class_id)), args.threads)
+            registered = min(args.capacity, len(newcomers))
+            problems += check(db, center_id, race_class_id, args.capacity, registered, len(newcomers) - registered)
+        finally:
+            if not args.keep:
+                for name in TENANT_COLLECTIONS:
+                    db[name].delete_many({"center_id": center_id})
+
+    if problems:
+        print("FAILED")
+        for p in problems:
+            print(f"  - {p}")
+        sys.exit(1)
+    print("OK: no overbooking, seat counter consistent, waitlist promoted in order, "
+          "lowered capacity respected, no seat left open next to the waitlist")
+
+if __name__ == "__main__":
+    main()
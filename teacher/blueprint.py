@@ -1,9 +1,14 @@
-import csv, io, re
+import csv, io, os, re
 from datetime import datetime
-from flask import render_template, request, redirect, url_for, flash, Response
+from flask import render_template, request, redirect, url_for, flash, Response, abort, send_file, stream_with_context
 from bson import ObjectId
-from database import get_db, ALLOWED_STATUSES
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from database import tenant_db, ALLOWED_STATUSES
+from cache_bus import cached, notify
+from flask_login import current_user
 from auth_helpers import teacher_required
+import exports
 from . import teacher_bp
 
 # -------- Utilities --------
@@ -12,12 +17,182 @@ def clean_phone(s: str | None) -> str:
     # keep digits and common dialing symbols
     return re.sub(r"[^\d+()\-\s]", "", s)
 
+# Fields compared when diffing an uploaded roster against stored students.
+ROSTER_FIELDS = [
+    "first_name", "last_name", "email", "student_id", "grade", "classes",
+    "reg_status", "notes", "dad_name", "dad_phone", "mom_name", "mom_phone",
+]
+# Rows looked up (one $in query) and written (one bulk_write) per chunk.
+UPLOAD_CHUNK_SIZE = 500
+# Changed rows listed on the dry-run preview page.
+DIFF_PREVIEW_LIMIT = 50
+
+def row_to_doc(row) -> dict:
+    """Parses one roster CSV row into student fields. Raises ValueError if invalid."""
+    student_id = (row.get("student_id") or "").strip() or None
+    email = (row.get("email") or "").strip().lower() or None
+    status = (row.get("reg_status") or "pending").strip().lower()
+    if status not in ALLOWED_STATUSES:
+        raise ValueError(f"Invalid reg_status '{status}'")
+    if not student_id and not email:
+        raise ValueError("Missing both student_id and email.")
+    return {
+        "first_name": (row.get("first_name") or "").strip(),
+        "last_name": (row.get("last_name") or "").strip(),
+        "email": email,
+        "student_id": student_id,
+        "grade": int(row.get("grade")) if (row.get("grade") or "").strip().isdigit() else None,
+        "classes": [c.strip() for c in (row.get("classes") or "").split("|") if c.strip()],
+        "reg_status": status,
+        "notes": (row.get("notes") or "").strip(),
+        # parent fields
+        "dad_name": (row.get("dad_name") or "").strip(),
+        "dad_phone": clean_phone(row.get("dad_phone")),
+        "mom_name": (row.get("mom_name") or "").strip(),
+        "mom_phone": clean_phone(row.get("mom_phone")),
+    }
+
+def student_key(doc) -> tuple:
+    """Students are matched on student_id when present, otherwise on email."""
+    return ("student_id", doc["student_id"]) if doc["student_id"] else ("email", doc["email"])
+
+class RosterDiff:
+    """
+    Applies an uploaded roster chunk by chunk, writing only real changes.
+
+    Each chunk loads the matching students with one $in query, compares
+    fields, and sends inserts plus $set-only-changed-fields updates in one
+    bulk_write. Repeated keys within an upload diff against the row before
+    them. With dry_run, nothing is written; counts and `preview` are still
+    filled in. `db` is a tenant_db(), so lookups and inserts stay in the
+    teacher's center.
+    """
+
+    def __init__(self, db, dry_run=False):
+        self.db = db
+        self.dry_run = dry_run
+        self.created = self.updated = self.unchanged = self.errors = 0
+        self.error_rows = []
+        self.preview = []
+        # key -> {"_id", "doc", "original", "new"}: current state of every key seen so far
+        self._state = {}
+
+    def _load(self, keys):
+        missing = {k for k in keys if k not in self._state}
+        ids = [v for f, v in missing if f == "student_id"]
+        emails = [v for f, v in missing if f == "email"]
+        ors = []
+        if ids:
+            ors.append({"student_id": {"$in": ids}})
+        if emails:
+            ors.append({"email": {"$in": emails}})
+        if not ors:
+            return
+        for ex in self.db.students.find({"$or": ors}, {f: 1 for f in ROSTER_FIELDS}):
+            for key in (("student_id", ex.get("student_id")), ("email", ex.get("email"))):
+                if key in missing and key not in self._state:
+                    doc = {f: ex.get(f) for f in ROSTER_FIELDS}
+                    self._state[key] = {"_id": ex["_id"], "doc": doc, "original": dict(doc), "new": False}
+
+    def _error(self, line, row, message):
+        self.errors += 1
+        row = dict(row)
+        row["_error"] = f"Row {line}: {message}"
+        self.error_rows.append(row)
+
+    def apply_chunk(self, rows):
+        """rows: list of (line_number, csv_row)."""
+        parsed = []
+        for line, row in rows:
+            try:
+                doc = row_to_doc(row)
+            except Exception as e:
+                self._error(line, row, e)
+                continue
+            parsed.append((line, row, doc))
+        self._load({student_key(doc) for _, _, doc in parsed})
+
+        touched = {}  # key -> (line, row, action) of the first row changing that key
+        for line, row, doc in parsed:
+            key = student_key(doc)
+            state = self._state.get(key)
+            if state is None:
+                self._state[key] = {"_id": None, "doc": doc, "original": {}, "new": True}
+                self.created += 1
+                touched[key] = (line, row, "created")
+                self._add_preview(line, "create", key, {f: [None, v] for f, v in doc.items()})
+                continue
+            changes = {f: [state["doc"].get(f), doc[f]] for f in ROSTER_FIELDS
+                       if state["doc"].get(f) != doc[f]}
+            if not changes:
+                self.unchanged += 1
+                continue
+            state["doc"].update(doc)
+            self.updated += 1
+            touched.setdefault(key, (line, row, "updated"))
+            self._add_preview(line, "update", key, changes)
+
+        if not self.dry_run and touched:
+            self._write(touched)
+
+    def _add_preview(self, line, action, key, changes):
+        if len(self.preview) < DIFF_PREVIEW_LIMIT:
+            self.preview.append({"line": line, "action": action,
+                                 "key": f"{key[0]}={key[1]}", "changes": changes})
+
+    def _write(self, touched):
+        now = datetime.utcnow()
+        ops, meta = [], []
+        for key, (line, row, action) in touched.items():
+            state = self._state[key]
+            doc = None
+            if state["new"]:
+                doc = dict(state["doc"], created_at=now, updated_at=now)
+                ops.append(InsertOne(self.db.students.stamp(doc)))
+            else:
+                changed = {f: v for f, v in state["doc"].items() if state["original"].get(f) != v}
+                if not changed:
+                    continue  # later rows reverted an earlier change
+                ops.append(UpdateOne({"_id": state["_id"]}, {"$set": dict(changed, updated_at=now)}))
+            meta.append((key, line, row, action, doc))
+        if not ops:
+            return
+
+        failed = set()
+        try:
+            self.db.students.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get("writeErrors", []):
+                key, line, row, action, _ = meta[err["index"]]
+                failed.add(key)
+                setattr(self, action, getattr(self, action) - 1)
+                self._error(line, row, err.get("errmsg", "write failed"))
+                del self._state[key]  # reload from the database if the key appears again
+        # With ordered=False the other ops are applied even when some fail.
+        notify("students")
+
+        for key, line, row, action, doc in meta:
+            if key in failed:
+                continue
+            state = self._state[key]
+            if state["new"]:
+                state["_id"] = doc["_id"]  # assigned client-side by InsertOne
+                state["new"] = False
+            state["original"] = dict(state["doc"])
+
 # -------- Views --------
 @teacher_bp.get("/students")
 @teacher_required
 def students_list():
-    db = get_db()
     q = (request.args.get("q") or "").strip()
+    return render_template("teacher/students_list.html",
+                           students=load_students(q),
+                           q=q,
+                           ALLOWED_STATUSES=sorted(ALLOWED_STATUSES))
+
+@cached("students")
+def load_students(q):
+    """Roster for the students page, optionally filtered by a search string."""
     filt = {}
     if q:
         filt = {"$or": [
@@ -31,16 +206,12 @@ def students_list():
             {"dad_phone": {"$regex": q, "$options": "i"}},
             {"mom_phone": {"$regex": q, "$options": "i"}},
         ]}
-    docs = list(db.students.find(filt).sort([("last_name", 1), ("first_name", 1)]))
-    return render_template("teacher/students_list.html",
-                           students=docs,
-                           q=q,
-                           ALLOWED_STATUSES=sorted(ALLOWED_STATUSES))
+    return list(tenant_db().students.find(filt).sort([("last_name", 1), ("first_name", 1)]))
 
 @teacher_bp.post("/students")
 @teacher_required
 def students_create_or_update():
-    db = get_db()
+    db = tenant_db()
     d = request.form
     student_id = (d.get("student_id") or "").strip() or None
     email = (d.get("email") or "").strip().lower() or None
@@ -75,17 +246,19 @@ def students_create_or_update():
     existing = db.students.find_one(key)
     if existing:
         db.students.update_one({"_id": existing["_id"]}, {"$set": doc})
+        notify("students")
         flash("Student updated.", "success")
     else:
         doc["created_at"] = datetime.utcnow()
         db.students.insert_one(doc)
+        notify("students")
         flash("Student created.", "success")
     return redirect(url_for("teacher.students_list"))
 
 @teacher_bp.post("/students/status/<id>")
 @teacher_required
 def students_update_status(id):
-    db = get_db()
+    db = tenant_db()
     status = (request.form.get("reg_status") or "").strip().lower()
     if status not in ALLOWED_STATUSES:
         flash("Invalid status.", "danger")
@@ -95,6 +268,7 @@ def students_update_status(id):
         "reg_status": status,
         "updated_at": datetime.utcnow()
     }})
+    notify("students")
     flash("Status updated.", "success")
     return redirect(url_for("teacher.students_list"))
 
@@ -113,82 +287,57 @@ def students_template():
 @teacher_bp.post("/students/upload")
 @teacher_required
 def students_upload():
-    db = get_db()   
     """
     CSV columns (header must match):
     student_id,first_name,last_name,email,grade,classes,reg_status,notes,dad_name,dad_phone,mom_name,mom_phone
     - classes: pipe-separated (Algebra 1 - Fall 2025|AMC 8)
     - reg_status: pending|registered|waitlisted|dropped
+    Only rows that actually change a student are written. With dry_run
+    checked, nothing is written and a preview of the changes is shown.
     """
+    db = tenant_db()
     f = request.files.get("file")
     if not f:
         flash("No file uploaded.", "danger")
         return redirect(url_for("teacher.students_list"))
+    dry_run = bool(request.form.get("dry_run"))
 
     text = io.TextIOWrapper(f.stream, encoding="utf-8", errors="ignore")
     reader = csv.DictReader(text)
-    created = updated = errors = 0
-    error_rows = []
-
+    diff = RosterDiff(db, dry_run=dry_run)
+    chunk = []
     for i, row in enumerate(reader, start=2):  # i=2 because header is line 1
-        try:
-            student_id = (row.get("student_id") or "").strip() or None
-            email = (row.get("email") or "").strip().lower() or None
-            status = (row.get("reg_status") or "pending").strip().lower()
-            if status not in ALLOWED_STATUSES:
-                raise ValueError(f"Invalid reg_status '{status}'")
-
-            doc = {
-                "first_name": (row.get("first_name") or "").strip(),
-                "last_name": (row.get("last_name") or "").strip(),
-                "email": email,
-                "student_id": student_id,
-                "grade": int(row.get("grade")) if (row.get("grade") or "").strip().isdigit() else None,
-                "classes": [c.strip() for c in (row.get("classes") or "").split("|") if c.strip()],
-                "reg_status": status,
-                "notes": (row.get("notes") or "").strip(),
-                # parent fields
-                "dad_name": (row.get("dad_name") or "").strip(),
-                "dad_phone": clean_phone(row.get("dad_phone")),
-                "mom_name": (row.get("mom_name") or "").strip(),
-                "mom_phone": clean_phone(row.get("mom_phone")),
-                "updated_at": datetime.utcnow(),
-            }
-
-            key = {"student_id": student_id} if student_id else {"email": email}
-            if not key.get("student_id") and not key.get("email"):
-                raise ValueError("Missing both student_id and email.")
-
-            ex = db.students.find_one(key)
-            if ex:
-                db.students.update_one({"_id": ex["_id"]}, {"$set": doc})
-                updated += 1
-            else:
-                doc["created_at"] = datetime.utcnow()
-                db.students.insert_one(doc)
-                created += 1
+        chunk.append((i, row))
+        if len(chunk) >= UPLOAD_CHUNK_SIZE:
+            diff.apply_chunk(chunk)
+            chunk = []
+    if chunk:
+        diff.apply_chunk(chunk)
 
-        except Exception as e:
-            errors += 1
-            row["_error"] = f"Row {i}: {e}"
-            error_rows.append(row)
+    if dry_run:
+        return render_template("teacher/students_upload_preview.html", diff=diff,
+                               preview_limit=DIFF_PREVIEW_LIMIT)
 
-    if errors:
+    if diff.error_rows:
         out = io.StringIO()
-        w = csv.DictWriter(out, fieldnames=list(error_rows[0].keys()))
+        fieldnames = list(diff.error_rows[0].keys())
+        for r in diff.error_rows:
+            fieldnames += [k for k in r if k not in fieldnames]
+        w = csv.DictWriter(out, fieldnames=fieldnames)
         w.writeheader()
-        w.writerows(error_rows)
+        w.writerows(diff.error_rows)
         out.seek(0)
         return Response(out.read(), mimetype="text/csv",
                         headers={"Content-Disposition": "attachment; filename=upload_errors.csv"})
 
-    flash(f"Upload done. Created: {created}, Updated: {updated}.", "success")
+    flash(f"Upload done. Created: {diff.created}, Updated: {diff.updated}, "
+          f"Unchanged: {diff.unchanged}.", "success")
     return redirect(url_for("teacher.students_list"))
 
 @teacher_bp.get("/students/export.csv")
 @teacher_required
 def students_export():
-    db = get_db()
+    db = tenant_db()
     docs = list(db.students.find().sort([("last_name", 1), ("first_name", 1)]))
     out = io.StringIO()
     headers = [
@@ -219,3 +368,76 @@ def students_export():
     out.seek(0)
     return Response(out.read(), mimetype="text/csv",
                     headers={"Content-Disposition":"attachment; filename=students_export.csv"})
+
+# -------- Spreadsheet / columnar exports --------
+@teacher_bp.get("/exports/<dataset>.<fmt>")
+@teacher_required
+def export_dataset(dataset, fmt):
+    """
+    Exports students, registrations, submissions or a class gradebook
+    (?class_id=) as xlsx, parquet or arrow. Large exports become background
+    jobs; the teacher is sent to the job page to download the file.
+    """
+    if dataset not in exports.DATASETS or fmt not in exports.EXPORT_FORMATS:
+        abort(404)
+    teacher_id = getattr(current_user, "id", None)
+    if not teacher_id:
+        abort(403)
+    class_id = (request.args.get("class_id") or "").strip() or None
+    if class_id and not ObjectId.is_valid(class_id):
+        abort(404)
+    db = tenant_db()
+    back = request.referrer or url_for("teacher.students_list")
+
+    try:
+        exports.check_available(fmt)
+        if exports.estimate_rows(db, dataset, teacher_id, class_id) > exports.EXPORT_BACKGROUND_ROWS[fmt]:
+            job_id = exports.start_export_job(dataset, fmt, teacher_id, class_id)
+            flash("This export is large and is being prepared in the background.", "success")
+            return redirect(url_for("teacher.export_job", job_id=job_id))
+
+        if fmt == "arrow":
+            columns, rows = exports.DATASETS[dataset](db, teacher_id, class_id)
+            return Response(stream_with_context(exports.stream_arrow(columns, rows)),
+                            mimetype=exports.MIMETYPES[fmt],
+                            headers={"Content-Disposition": f"attachment; filename={dataset}.{fmt}"})
+
+        path = exports.export_to_file(dataset, fmt, teacher_id, class_id)
+    except exports.ExportUnavailable as e:
+        flash(str(e), "danger")
+        return redirect(back)
+    except PermissionError:
+        abort(403)
+    except ValueError as e:
+        flash(str(e), "danger")
+        return redirect(back)
+
+    response = send_file(path, mimetype=exports.MIMETYPES[fmt],
+                         as_attachment=True, download_name=f"{dataset}.{fmt}")
+    response.call_on_close(lambda: os.remove(path))
+    return response
+
+@teacher_bp.get("/exports/jobs/<job_id>")
+@teacher_required
+def export_job(job_id):
+    if not ObjectId.is_valid(job_id):
+        abort(404)
+    job = tenant_db().export_jobs.find_one({"_id": ObjectId(job_id)})
+    if not job or job["created_by"] != ObjectId(getattr(current_user, "id", None)):
+        abort(404)
+    return render_template("teacher/export_job.html", job=job)
+
+@teacher_bp.get("/exports/jobs/<job_id>/download")
+@teacher_required
+def export_job_download(job_id):
+    if not ObjectId.is_valid(job_id):
+        abort(404)
+    job = tenant_db().export_jobs.find_one({"_id": ObjectId(job_id), "status": "done"})
+    if not job or job["created_by"] != ObjectId(getattr(current_user, "id", None)):
+        abort(404)
+    # The TTL monitor runs only once a minute, and the file may already be purged
+    if job.get("expires_at", datetime.max) <= datetime.utcnow() or not os.path.exists(job["path"]):
+        abort(410)
+    return send_file(job["path"], mimetype=exports.MIMETYPES[job["format"]],
+                     as_attachment=True, download_name=f"{job['dataset']}.{job['format']}")
+